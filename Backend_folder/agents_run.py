@@ -1,185 +1,434 @@
-from product_search import ProductSearchAgent
-from customer_support import CustomerSupportAgent
-from order_agent import OrderAgent
-from cart_agent import CartAgent
-from typing import Dict, Any
-from langgraph.graph import StateGraph, END
-import re
-
-# ===== Config =====
-FAQ_FILE = "faqs_and_policies.csv"
-ORDERS_FILE = "sample_orders.json"
-EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-
-FAISS_INDEX_FILE = "embeddings/faiss_index.index"
-ID_MAPPING_FILE = "embeddings/id_mapping.json"
-
-# ===== Initialize agents =====
-product_agent = ProductSearchAgent(
-    faiss_index_file=FAISS_INDEX_FILE,
-    id_mapping_file=ID_MAPPING_FILE,
-    embedding_model=EMBEDDING_MODEL
-)
-
-support_agent = CustomerSupportAgent(FAQ_FILE, EMBEDDING_MODEL)
-order_agent = OrderAgent(ORDERS_FILE)
-cart_agent = CartAgent(user_id="guest")
-
-
-# ===== Controller Logic =====
-def controller_agent(state: Dict[str, Any]) -> Dict[str, Any]:
-    query = state["query"].lower().strip()
-
-    # ---- Cart Intents ----
-    if ("add" in query and "cart" in query) or \
-       ("remove" in query and "cart" in query) or \
-       "view cart" in query or \
-       "clear cart" in query:
-        state["intent"] = "cart"
-
-    # ---- Order Intents ----
-    elif any(word in query for word in ["track", "cancel", "order", "deliver", "return"]):
-        # ✅ Only trigger OrderAgent if Order ID present
-        if re.search(r"\bord\d+\b", state["query"], re.IGNORECASE):
-            state["intent"] = "order"
-        else:
-            state["intent"] = "support"
-
-    # ---- Product Search Intents ----
-    elif any(word in query for word in [
-        "buy", "find", "show", "price", "sneakers", "shoes", "shirt",
-        "jeans", "sunglasses", "tshirt"
-    ]):
-        state["intent"] = "product"
-
-    # ---- Customer Support Intents ----
-    else:
-        state["intent"] = "support"
-
-    return state
-
-
-# ===== Agent Execution Functions =====
-def run_cart(state: Dict[str, Any]) -> Dict[str, Any]:
-    original_query = state["query"].strip()   # preserve case
-    q = original_query.lower()                # lowercase for intent detection
-    words = original_query.split()            # original words for productID
-
-    productID = None
-    for i, w in enumerate(words):
-        if w.lower() == "productid" and i + 1 < len(words):
-            productID = words[i + 1]   # keep case-sensitive (e.g. "P011")
-            break
-
-    result = {
-        "message": "⚠️ Could not understand cart action.",
-        "cart": [],
-        "total": 0,
-        "count": 0
-    }
-
-    if "add" in q and productID:
-        result = cart_agent.add_to_cart(productID, quantity=1)
-    elif "remove one" in q and productID:
-        result = cart_agent.remove_one(productID)
-    elif "remove" in q and productID:
-        result = cart_agent.remove_from_cart(productID)
-    elif "view" in q:
-        result = cart_agent.view_cart()
-    elif "clear" in q:
-        result = cart_agent.clear_cart()
-
-    state["result"] = result
-    return state
-
-
-def run_order(state: Dict[str, Any]) -> Dict[str, Any]:
-    state["result"] = order_agent.process_query(state["query"])
-    return state
-
-
-def run_product(state: Dict[str, Any]) -> Dict[str, Any]:
-    products = product_agent.search(state["query"])
-    normalized = []
-    for p in products:
-        normalized.append({
-            "productID": p.get("productID") or p.get("id") or p.get("product_id"),
-            "title": p.get("title", ""),
-            "description": p.get("description", ""),
-            "price": p.get("price", 0),
-            "image_url": p.get("image_url") or p.get("image", "")
-        })
-    state["result"] = normalized
-    return state
-
-
-def run_support(state: Dict[str, Any]) -> Dict[str, Any]:
-    state["result"] = support_agent.search(state["query"])
-    return state
-
-
-# ===== LangGraph Workflow =====
-workflow = StateGraph(dict)
-
-workflow.add_node("controller", controller_agent)
-workflow.add_node("cart", run_cart)
-workflow.add_node("order", run_order)
-workflow.add_node("product", run_product)
-workflow.add_node("support", run_support)
-
-workflow.add_conditional_edges(
-    "controller",
-    lambda state: state["intent"],
-    {
-        "cart": "cart",
-        "order": "order",
-        "product": "product",
-        "support": "support",
-    }
-)
-
-workflow.add_edge("cart", END)
-workflow.add_edge("order", END)
-workflow.add_edge("product", END)
-workflow.add_edge("support", END)
-
-workflow.set_entry_point("controller")
-app = workflow.compile()
-
-
-# ===== Run Agents (Main Entry) =====
-def run_agents(query: str) -> Dict[str, Any]:
-    final_state = app.invoke({"query": query})
-    intent = final_state.get("intent", "unknown")
-    result = final_state.get("result", {})
-
-    response = {
-        "type": intent,
-        "intent": intent,
-        "message": "",
-        "cart": [],
-        "total": 0,
-        "count": 0,
-        "products": []
-    }
-
-    if intent == "cart" and isinstance(result, dict):
-        response["message"] = result.get("message", "")
-        response["cart"] = result.get("cart", [])
-        response["total"] = result.get("total", 0)
-        response["count"] = result.get("count", 0)
-
-    elif intent == "product" and isinstance(result, list):
-        response["products"] = result
-        response["message"] = "Here are some products you might like."
-
-    elif intent == "order":
-        response["message"] = str(result)
-
-    elif intent == "support":
-        response["message"] = str(result)
-
-    else:
-        response["message"] = "Sorry, I couldn’t understand your request."
-
-    return response
+from product_search import CATEGORY_SYNONYMS, COLOR_KEYWORDS, GENDER_KEYWORDS, ProductSearchAgent
+from sharded_search import SEARCH_SHARDS, ShardedProductSearch
+from customer_support import CustomerSupportAgent
+from order_agent import OrderAgent
+from cart_agent import CartAgent
+from session_store import InMemorySessionStore
+from autocomplete import SUGGEST_LIMIT, build_suggestion_index, popularity_from_orders
+from typing import Dict, Any, List, Optional, Tuple
+from langgraph.graph import StateGraph, END
+from collections import Counter
+from contextlib import contextmanager
+import os
+import re
+import threading
+from metrics import log_event, timed
+
+# ===== Config =====
+FAQ_FILE = "faqs_and_policies.csv"
+ORDERS_FILE = "sample_orders.json"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+FAISS_INDEX_FILE = "embeddings/faiss_index.index"
+ID_MAPPING_FILE = "embeddings/id_mapping.json"
+
+# "direct" runs controller + agent node as plain calls; "langgraph" goes through the compiled graph
+EXECUTION_MODES = ("direct", "langgraph")
+EXECUTION_MODE = os.getenv("HAPPYCART_EXECUTION_MODE", "direct")
+if EXECUTION_MODE not in EXECUTION_MODES:
+    raise ValueError(f"HAPPYCART_EXECUTION_MODE must be one of {EXECUTION_MODES}, got '{EXECUTION_MODE}'")
+
+# "productid P011 x2, P014 x1 and P020": everything after "productid" is a list of
+# IDs (must contain a digit) with an optional "x<qty>" / "qty <n>"
+CART_ITEMS_PATTERN = re.compile(r"\bproductids?\b(.*)", re.IGNORECASE)
+CART_ITEM_SEPARATOR = re.compile(r",|;|\band\b|\bproductids?\b", re.IGNORECASE)
+CART_ITEM_PATTERN = re.compile(r"^([A-Za-z0-9_-]*\d[A-Za-z0-9_-]*)(?:\s*[x×*]\s*(\d+)|\s+qty\s*(\d+))?", re.IGNORECASE)
+
+# Follow-ups that refer back to the session's last product search
+ORDINALS = {"first": 0, "1st": 0, "second": 1, "2nd": 1, "third": 2, "3rd": 2,
+            "fourth": 3, "4th": 3, "fifth": 4, "5th": 4, "last": -1}
+ORDINAL_PATTERN = re.compile(rf"\b({'|'.join(ORDINALS)})\s+(?:one|item|product)\b", re.IGNORECASE)
+FOLLOWUP_PATTERNS = [
+    ("cheaper", re.compile(r"\b(cheaper|less expensive|lower price)", re.IGNORECASE)),
+    ("pricier", re.compile(r"\b(pricier|costlier|more expensive|higher price)", re.IGNORECASE)),
+    ("more", re.compile(r"\b(show|see) more\b|\b(more|next|other)\s+(ones|results|products|options|items)\b|^\s*(more|next)\W*$", re.IGNORECASE)),
+    ("refine", re.compile(r"\b(only|just)\b|\b(ones|those|them)\b", re.IGNORECASE)),
+]
+# A follow-up may only use these words (plus numbers and the last search's category): any other
+# word ("laces", "sneakers" after a sunglasses search) makes the query a new search
+FOLLOWUP_WORDS = {
+    "only", "just", "ones", "those", "them", "one", "the", "a", "an", "some", "any", "me", "i", "we",
+    "show", "see", "give", "get", "want", "need", "please", "now", "ok", "okay", "what", "about", "how",
+    "in", "with", "for", "and", "or", "of", "to", "are", "is", "there", "something", "anything", "else",
+    "bit", "little", "slightly", "even", "much",
+    "next", "other", "results", "products", "options", "items",
+    "cheaper", "pricier", "costlier", "lower", "higher",
+    "under", "below", "above", "over", "less", "more", "than", "rs", "inr", "price", "priced",
+    "lowest", "cheapest", "least", "highest", "most", "expensive", "costliest",
+    *COLOR_KEYWORDS, *(keyword for keywords in GENDER_KEYWORDS.values() for keyword in keywords),
+}
+
+# ===== Initialize agents =====
+# HAPPYCART_SEARCH_SHARDS > 1 spreads the product vectors over that many worker processes
+product_agent = (ShardedProductSearch if SEARCH_SHARDS > 1 else ProductSearchAgent)(
+    faiss_index_file=FAISS_INDEX_FILE,
+    id_mapping_file=ID_MAPPING_FILE,
+    embedding_model=EMBEDDING_MODEL
+)
+
+support_agent = CustomerSupportAgent(FAQ_FILE, EMBEDDING_MODEL)
+order_agent = OrderAgent(ORDERS_FILE)
+cart_agent = CartAgent(user_id="guest")
+
+# Conversation context per session_id; any SessionStore backend can be swapped in here
+session_store = InMemorySessionStore()
+
+# Typeahead suggestions, rebuilt by reload_catalog()
+suggestion_index = build_suggestion_index(product_agent.products, popularity_from_orders(order_agent.orders))
+
+
+# ===== Controller Logic =====
+def controller_agent(state: Dict[str, Any]) -> Dict[str, Any]:
+    with timed("routing") as span:
+        route_intent(state)
+        span.intent = state["intent"]
+    return state
+
+
+def route_intent(state: Dict[str, Any]) -> Dict[str, Any]:
+    query = state["query"].lower().strip()
+
+    # ---- Cart Intents ----
+    if ("add" in query and "cart" in query) or \
+       ("remove" in query and "cart" in query) or \
+       "view cart" in query or \
+       "clear cart" in query:
+        state["intent"] = "cart"
+
+    # ---- Order Intents ----
+    elif any(word in query for word in ["track", "cancel", "order", "deliver", "return"]):
+        # ✅ Only trigger OrderAgent if Order ID present
+        if re.search(r"\bord\d+\b", state["query"], re.IGNORECASE):
+            state["intent"] = "order"
+        else:
+            state["intent"] = "support"
+
+    # ---- Product Search Intents ----
+    elif any(word in query for word in [
+        "buy", "find", "show", "price", "sneakers", "shoes", "shirt",
+        "jeans", "sunglasses", "tshirt"
+    ]) or (state.get("context") and parse_followup(query, state["context"])):
+        state["intent"] = "product"
+
+    # ---- Customer Support Intents ----
+    else:
+        state["intent"] = "support"
+
+    return state
+
+
+# ===== Agent Execution Functions =====
+def parse_cart_items(query: str) -> List[Tuple[str, int]]:
+    """[(productID, quantity), ...] from "productid P011 x2, P014 x1"; IDs keep their case"""
+    match = CART_ITEMS_PATTERN.search(query)
+    if not match:
+        return []
+    items = []
+    for part in CART_ITEM_SEPARATOR.split(match.group(1)):
+        item = CART_ITEM_PATTERN.match(part.strip())
+        if item:
+            items.append((item.group(1), int(item.group(2) or item.group(3) or 1)))
+    return items
+
+
+def parse_followup(query: str, context: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, Optional[int]]]:
+    """("ordinal", index) for "the second one", or (kind, None) for a product follow-up
+    ("cheaper", "pricier", "more", "refine") of the search in `context`; None if the query
+    stands on its own"""
+    ordinal = ORDINAL_PATTERN.search(query)
+    if ordinal:
+        return "ordinal", ORDINALS[ordinal.group(1).lower()]
+    for kind, pattern in FOLLOWUP_PATTERNS:
+        if not pattern.search(query):
+            continue
+        filters = product_agent.parse_filters(query)
+        if not is_follow_up(query, filters, context):
+            return None
+        if kind == "refine" and not any(filters.values()):
+            continue
+        last_filters = (context or {}).get("filters") or {}
+        if kind == "more" and any(v is not None and v != last_filters.get(k) for k, v in filters.items()):
+            kind = "refine"   # "show more red ones": narrow, starting again from the top
+        return kind, None
+    return None
+
+
+def is_follow_up(query: str, filters: Dict[str, Any], context: Optional[Dict[str, Any]]) -> bool:
+    """Whether a query matching a follow-up pattern builds on the last search rather than starting
+    a new one: no category other than the last search's, and no search word of its own"""
+    last_category = ((context or {}).get("filters") or {}).get("category")
+    if filters["category"] and filters["category"] != last_category:
+        return False
+    allowed = FOLLOWUP_WORDS
+    if filters["category"]:
+        allowed = allowed | {word for keyword in CATEGORY_SYNONYMS[filters["category"]]
+                             for word in re.findall(r"[a-z0-9']+", keyword)}
+    return all(word.isdigit() or word in allowed for word in re.findall(r"[a-z0-9']+", query.lower()))
+
+
+def shown_product(state: Dict[str, Any], index: int) -> Optional[str]:
+    """productID at `index` among the products the session was last shown"""
+    shown = (state.get("context") or {}).get("shown", [])
+    return shown[index] if -len(shown) <= index < len(shown) else None
+
+
+def run_cart(state: Dict[str, Any]) -> Dict[str, Any]:
+    original_query = state["query"].strip()   # preserve case
+    q = original_query.lower()                # lowercase for intent detection
+    items = parse_cart_items(original_query)
+    if not items and state.get("context"):
+        # "add the second one to cart" → productID from the last search shown in this session
+        followup = parse_followup(original_query, state["context"])
+        if followup and followup[0] == "ordinal" and shown_product(state, followup[1]):
+            items = [(shown_product(state, followup[1]), 1)]
+    productID = items[0][0] if items else None
+
+    result = {
+        "message": "⚠️ Could not understand cart action.",
+        "cart": [],
+        "total": 0,
+        "count": 0
+    }
+
+    if "add" in q and len(items) > 1:
+        result = cart_agent.add_items(items)
+    elif "add" in q and productID:
+        result = cart_agent.add_to_cart(productID, quantity=items[0][1])
+    elif "remove one" in q and len(items) > 1:
+        result = cart_agent.remove_one_items([pid for pid, _ in items])
+    elif "remove one" in q and productID:
+        result = cart_agent.remove_one(productID)
+    elif "remove" in q and len(items) > 1:
+        result = cart_agent.remove_items([pid for pid, _ in items])
+    elif "remove" in q and productID:
+        result = cart_agent.remove_from_cart(productID)
+    elif "view" in q:
+        result = cart_agent.view_cart()
+    elif "clear" in q:
+        result = cart_agent.clear_cart()
+
+    state["result"] = result
+    return state
+
+
+def run_order(state: Dict[str, Any]) -> Dict[str, Any]:
+    state["result"] = order_agent.process_query(state["query"])
+    return state
+
+
+def normalize_products(products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    normalized = []
+    for p in products:
+        normalized.append({
+            "productID": p.get("productID") or p.get("id") or p.get("product_id"),
+            "title": p.get("title", ""),
+            "description": p.get("description", ""),
+            "price": p.get("price", 0),
+            "image_url": p.get("image_url") or p.get("image", "")
+        })
+    return normalized
+
+
+def run_product(state: Dict[str, Any]) -> Dict[str, Any]:
+    context = state.get("context")
+    followup = parse_followup(state["query"], context) if context else None
+    if followup and followup[0] == "ordinal":
+        pid = shown_product(state, followup[1])
+        with leased_product_agent() as agent:
+            products = [agent.products[pid]] if pid in agent.products else []
+    elif followup:
+        # Re-filter / re-slice the cached search instead of parsing, filtering and embedding again
+        with leased_product_agent() as agent:
+            products, context = agent.follow_up(context, followup[0], state["query"])
+    else:
+        with leased_product_agent() as agent:
+            products, context = agent.search_with_context(state["query"])
+
+    if state.get("session_id") and context["shown"]:
+        session_store.put(state["session_id"], context)
+    state["result"] = normalize_products(products)
+    return state
+
+
+def run_support(state: Dict[str, Any]) -> Dict[str, Any]:
+    state["result"] = support_agent.search(state["query"])
+    return state
+
+
+# ===== LangGraph Workflow =====
+AGENT_NODES = {
+    "cart": run_cart,
+    "order": run_order,
+    "product": run_product,
+    "support": run_support,
+}
+
+
+def build_workflow(nodes=AGENT_NODES, controller=controller_agent):
+    """controller → one agent node → END, as a compiled LangGraph"""
+    workflow = StateGraph(dict)
+
+    workflow.add_node("controller", controller)
+    for name, node in nodes.items():
+        workflow.add_node(name, node)
+        workflow.add_edge(name, END)
+
+    workflow.add_conditional_edges(
+        "controller",
+        lambda state: state["intent"],
+        {name: name for name in nodes}
+    )
+
+    workflow.set_entry_point("controller")
+    return workflow.compile()
+
+
+app = build_workflow()
+
+
+# ===== Direct Dispatch =====
+def dispatch(state: Dict[str, Any], nodes=AGENT_NODES, controller=controller_agent) -> Dict[str, Any]:
+    """Same controller → agent path as `app`, as two plain calls (no graph runtime or state copies)"""
+    state = controller(state)
+    return nodes[state["intent"]](state)
+
+
+# ===== Run Agents (Main Entry) =====
+def run_agents(query: str, mode: str = EXECUTION_MODE, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """Without a session_id every query is answered on its own; with one, follow-ups
+    ("show cheaper ones", "add the second one to cart") use the session's last search."""
+    state = {"query": query, "session_id": session_id,
+             "context": session_store.get(session_id) if session_id else None}
+    if mode == "langgraph":
+        final_state = app.invoke(state)
+    else:
+        final_state = dispatch(state)
+    intent = final_state.get("intent", "unknown")
+    result = final_state.get("result", {})
+
+    response = {
+        "type": intent,
+        "intent": intent,
+        "message": "",
+        "cart": [],
+        "total": 0,
+        "count": 0,
+        "products": []
+    }
+
+    if intent == "cart" and isinstance(result, dict):
+        response["message"] = result.get("message", "")
+        response["cart"] = result.get("cart", [])
+        response["total"] = result.get("total", 0)
+        response["count"] = result.get("count", 0)
+
+    elif intent == "product" and isinstance(result, list):
+        response["products"] = result
+        response["message"] = "Here are some products you might like."
+
+    elif intent == "order":
+        response["message"] = str(result)
+        response["result"] = result
+
+    elif intent == "support":
+        response["message"] = str(result)
+        response["result"] = result
+
+    else:
+        response["message"] = "Sorry, I couldn’t understand your request."
+
+    return response
+
+
+# ===== Batch Product Search =====
+def search_products_batch(queries: List[str], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+    with leased_product_agent() as agent:
+        results = agent.search_many(queries, top_k=top_k)
+    return [normalize_products(products) for products in results]
+
+
+# ===== Cart Badge =====
+def cart_summary(user_id: str = "guest") -> Dict[str, Any]:
+    return CartAgent(user_id=user_id).summary()
+
+
+# ===== Bulk Cart Update =====
+def bulk_cart(user_id: str, action: str, items: List[Tuple[str, int]]) -> Dict[str, Any]:
+    agent = cart_agent if user_id == cart_agent.user_id else CartAgent(user_id=user_id)
+    if action == "remove":
+        return agent.remove_items([pid for pid, _ in items])
+    return agent.add_items(items)
+
+
+# ===== Autocomplete =====
+def suggest(prefix: str, limit: int = SUGGEST_LIMIT) -> List[Dict[str, Any]]:
+    return suggestion_index.suggest(prefix, limit)
+
+
+# ===== Catalog Reload =====
+class CatalogReloadInProgress(Exception):
+    """Raised when reload_catalog is called while another reload is still running"""
+
+
+_reload_lock = threading.Lock()
+_agent_leases = threading.Lock()
+_agent_users = Counter()  # search agent → searches currently running on it
+_retired_agents = set()   # agents swapped out by a reload, closed when their last search ends
+
+
+def _close_agent(agent):
+    if hasattr(agent, "close"):
+        agent.close(cancel_pending=False)
+
+
+@contextmanager
+def leased_product_agent():
+    """The current product agent, kept open until the block exits even if a reload swaps it out"""
+    with _agent_leases:
+        agent = product_agent
+        _agent_users[agent] += 1
+    try:
+        yield agent
+    finally:
+        with _agent_leases:
+            _agent_users[agent] -= 1
+            last = not _agent_users[agent]
+            if last:
+                del _agent_users[agent]
+            retired = last and agent in _retired_agents
+            if retired:
+                _retired_agents.discard(agent)
+        if retired:
+            _close_agent(agent)
+
+
+def reload_catalog() -> Dict[str, Any]:
+    """Reload products and vectors into a new search agent (reusing the embedder), rebuild the
+    suggestions, then swap both in.
+
+    Searches that leased the old agent finish on it: the old agent is closed (sharded: its
+    worker pools shut down) right away if none are running, else by the last of them to
+    finish. One reload runs at a time; a concurrent call raises CatalogReloadInProgress.
+    """
+    global product_agent, suggestion_index
+    if not _reload_lock.acquire(blocking=False):
+        raise CatalogReloadInProgress()
+    try:
+        old_agent = product_agent
+        agent = type(old_agent)(
+            faiss_index_file=FAISS_INDEX_FILE,
+            id_mapping_file=ID_MAPPING_FILE,
+            embedding_model=EMBEDDING_MODEL,
+            embedder=old_agent.embedder
+        )
+        index = build_suggestion_index(agent.products, popularity_from_orders(order_agent.orders))
+        with _agent_leases:
+            product_agent, suggestion_index = agent, index
+            in_flight = _agent_users[old_agent]
+            if in_flight:
+                _retired_agents.add(old_agent)
+        if not in_flight:
+            _close_agent(old_agent)
+        return {"products": len(agent.products), "suggestions": len(index)}
+    finally:
+        _reload_lock.release()
@@ -0,0 +1,111 @@
+"""
+Typeahead suggestions served from a sorted array of phrases, without routing, embedding or the LLM.
+
+Every product title is indexed under each of its word positions ("black classic white sneakers",
+"classic white sneakers", ...), so typing any word of a title finds it. Categories, their synonyms,
+colors and color + category pairs from product_search's vocabularies are indexed too. A prefix
+is a bisect range over the sorted keys; the best suggestions for short prefixes are precomputed.
+"""
+import bisect
+import heapq
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from product_search import CATEGORY_SYNONYMS, COLOR_KEYWORDS
+
+# ===== Config =====
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+PRECOMPUTED_PREFIX_LEN = 3  # prefixes up to this length are answered from a table (their ranges are huge)
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9']+", text.lower()))
+
+
+def popularity_from_orders(orders: Dict[str, Dict[str, Any]]) -> Counter:
+    """Units ordered per productID, from OrderAgent.orders"""
+    units = Counter()
+    for order in orders.values():
+        for item in order.get("items", []):
+            if item.get("productID"):
+                units[item["productID"]] += item.get("quantity", 1)
+    return units
+
+
+class SuggestionIndex:
+    """Immutable prefix index: build a new one and swap it in when the catalog changes."""
+
+    def __init__(self, phrases: Dict[str, Dict[str, Any]]):
+        """phrases: display text → {"type", "score", ...}; higher score ranks first"""
+        entries = []
+        for text, info in phrases.items():
+            words = normalize(text).split()
+            for start in range(len(words)):
+                entries.append((" ".join(words[start:]), text))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.texts = [text for _, text in entries]
+        self.phrases = phrases
+
+        # Best SUGGEST_MAX_LIMIT texts for every short prefix, filled in score order
+        self.top = {}
+        for key, text in sorted(entries, key=lambda entry: -phrases[entry[1]]["score"]):
+            for length in range(1, min(PRECOMPUTED_PREFIX_LEN, len(key)) + 1):
+                bucket = self.top.setdefault(key[:length], [])
+                if len(bucket) < SUGGEST_MAX_LIMIT and text not in bucket:
+                    bucket.append(text)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def suggest(self, prefix: str, limit: int = SUGGEST_LIMIT) -> List[Dict[str, Any]]:
+        prefix = normalize(prefix)
+        limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+        if not prefix:
+            return []
+        if len(prefix) <= PRECOMPUTED_PREFIX_LEN:
+            texts = self.top.get(prefix, [])[:limit]
+        else:
+            lo = bisect.bisect_left(self.keys, prefix)
+            hi = bisect.bisect_right(self.keys, prefix + "\uffff", lo)
+            texts = heapq.nlargest(limit, set(self.texts[lo:hi]), key=lambda text: self.phrases[text]["score"])
+        return [{"text": text, **self.phrases[text]} for text in texts]
+
+
+def build_suggestion_index(products: Dict[str, Dict[str, Any]], popularity: Optional[Counter] = None) -> SuggestionIndex:
+    """Suggestions from the catalog (ProductSearchAgent.products) and the search vocabularies.
+
+    A title scores one point per listing plus the units ordered of those listings; a keyword
+    scores the number of products it would match.
+    """
+    popularity = popularity or Counter()
+    phrases = {}
+    for pid, prod in products.items():
+        title = " ".join(prod["title"].split())
+        entry = phrases.setdefault(title, {"type": "product", "score": 0, "productID": pid})
+        entry["score"] += 1 + popularity.get(pid, 0)
+
+    category_counts = Counter(prod["category"].lower() for prod in products.values())
+    color_counts = Counter()
+    for prod in products.values():
+        title_words = set(normalize(prod["title"]).split())
+        for color in COLOR_KEYWORDS:
+            if color in title_words:
+                color_counts[color, prod["category"].lower()] += 1
+
+    for category, keywords in CATEGORY_SYNONYMS.items():
+        if not category_counts[category]:
+            continue
+        for keyword in keywords:
+            phrases.setdefault(keyword, {"type": "category", "score": category_counts[category]})
+        for color in COLOR_KEYWORDS:
+            if color_counts[color, category]:
+                for keyword in keywords:
+                    phrases.setdefault(f"{color} {keyword}", {"type": "keyword", "score": color_counts[color, category]})
+    for color in COLOR_KEYWORDS:
+        total = sum(count for (c, _), count in color_counts.items() if c == color)
+        if total:
+            phrases.setdefault(color, {"type": "color", "score": total})
+    return SuggestionIndex(phrases)
@@ -0,0 +1,443 @@
+"""
+Benchmark for the /chat pipeline with local stand-ins.
+
+    python benchmark.py --products 20000 --requests 2000 --concurrency 8 --output bench.json
+
+- Catalog: synthetic products from data.generate_synthetic_catalog, embedded into a fresh FAISS index
+- Postgres: the local instance from DB_CONFIG, isolated in its own schema (dropped afterwards)
+- Ollama: a fake `ollama` executable put first on PATH that sleeps --llm-latency-ms and echoes a reply
+
+Replays a mixed-intent query workload through main.chat_endpoint and reports
+QPS, end-to-end and per-stage p50/p95/p99 latency, and peak memory. `--stress-threads`
+adds a concurrency check of the cart and order agents (lost updates must be 0).
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+import faiss
+import numpy as np
+import pandas as pd
+import psycopg2
+from sentence_transformers import SentenceTransformer
+
+import cart_agent
+import embeddings_and_db
+import migrations
+import product_search
+from data import generate_synthetic_catalog
+from prometheus_client import REGISTRY
+
+from metrics import add_stage_observer, remove_stage_observer
+
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+FAQ_FILE = "faqs_and_policies.csv"
+ORDERS_FILE = "sample_orders.json"
+
+REPLY_MODES = ("llm", "template", "fallback", "shed")
+
+# Share of each intent in the replayed workload
+WORKLOAD_MIX = {"product": 0.5, "support": 0.2, "order": 0.15, "cart": 0.15}
+
+FAKE_OLLAMA = """#!{python}
+import sys, time
+time.sleep({delay_s})
+print("Here is a short, friendly answer about your request.")
+"""
+
+
+# ===== Setup =====
+def read_faq_csv(path):
+    # The FAQ CSV is not always UTF-8 (same fallback as embeddings_and_db)
+    try:
+        return pd.read_csv(path, encoding="utf-8")
+    except UnicodeDecodeError:
+        return pd.read_csv(path, encoding="latin1")
+
+
+def build_workdir(workdir, products):
+    """Copy FAQ/order fixtures and build embeddings + FAISS index for the synthetic catalog"""
+    for name in (FAQ_FILE, ORDERS_FILE):
+        shutil.copy(os.path.join(BACKEND_DIR, name), os.path.join(workdir, name))
+
+    faq_df = read_faq_csv(os.path.join(workdir, FAQ_FILE))
+    faq_texts = (faq_df["question"] + " " + faq_df["answer"]).tolist()
+
+    model = SentenceTransformer(EMBED_MODEL)
+    texts = [p["title"] + " " + p["description"] for p in products] + faq_texts
+    ids = [p["product_id"] for p in products] + faq_df["id"].astype(str).tolist()
+    embeddings = np.asarray(model.encode(texts, batch_size=256, show_progress_bar=True), dtype="float32")
+
+    os.makedirs(os.path.join(workdir, "embeddings"), exist_ok=True)
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    faiss.write_index(index, os.path.join(workdir, "embeddings", "faiss_index.index"))
+    with open(os.path.join(workdir, "embeddings", "id_mapping.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+
+
+def setup_database(schema, products):
+    """Load the catalog into an isolated schema and point the agents' DB_CONFIG at it"""
+    options = f"-c search_path={schema}"
+    conn = psycopg2.connect(**cart_agent.DB_CONFIG)
+    with conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path TO {schema}")
+        cur.execute(embeddings_and_db.create_products_table)
+        cur.execute(embeddings_and_db.create_cart_table)
+        embeddings_and_db.insert_products(cur, products)
+    migrations.apply_migrations(conn)
+    conn.close()
+
+    for config in (cart_agent.DB_CONFIG, product_search.DB_CONFIG):
+        config["options"] = options
+
+
+def drop_database(schema):
+    config = {k: v for k, v in cart_agent.DB_CONFIG.items() if k != "options"}
+    conn = psycopg2.connect(**config)
+    with conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.close()
+
+
+def install_fake_ollama(workdir, latency_ms):
+    bin_dir = os.path.join(workdir, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "ollama")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(FAKE_OLLAMA.format(python=sys.executable, delay_s=latency_ms / 1000))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+
+# ===== Workload =====
+def build_workload(num_requests, products, faq_questions, order_ids, seed):
+    rng = random.Random(seed)
+    product_ids = [p["product_id"] for p in products]
+    categories = ["shoes", "sneakers", "jeans", "shirts", "sunglasses"]
+    colors = ["black", "white", "red", "blue", "grey"]
+
+    generators = {
+        "product": lambda: rng.choice([
+            f"show me {rng.choice(colors)} {rng.choice(categories)}",
+            f"find {rng.choice(categories)} for {rng.choice(['men', 'women'])}",
+            f"show {rng.choice(categories)} under {rng.randrange(2000, 8000, 500)}",
+            f"cheapest {rng.choice(categories)}",
+            f"buy something stylish for summer",
+        ]),
+        "support": lambda: rng.choice(faq_questions),
+        "order": lambda: rng.choice([
+            f"track order {rng.choice(order_ids)}",
+            f"cancel order {rng.choice(order_ids)}",
+        ]),
+        "cart": lambda: rng.choice([
+            f"add productid {rng.choice(product_ids)} to cart",
+            f"remove one productid {rng.choice(product_ids)} from cart",
+            "view cart",
+        ]),
+    }
+    intents = rng.choices(list(WORKLOAD_MIX), weights=list(WORKLOAD_MIX.values()), k=num_requests)
+    return [generators[intent]() for intent in intents]
+
+
+# ===== Reporting =====
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples_seconds):
+    values = sorted(samples_seconds)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def reply_counts():
+    """Current happycart_replies_total values as {(intent, mode): count}"""
+    counts = {}
+    for intent in WORKLOAD_MIX:
+        for mode in REPLY_MODES:
+            value = REGISTRY.get_sample_value("happycart_replies_total", {"intent": intent, "mode": mode})
+            counts[(intent, mode)] = value or 0.0
+    return counts
+
+
+def generation_share(before, after):
+    """Share of measured replies per intent that skipped LLM generation"""
+    share = {}
+    for intent in WORKLOAD_MIX:
+        deltas = {mode: after[(intent, mode)] - before[(intent, mode)] for mode in REPLY_MODES}
+        total = sum(deltas.values())
+        share[intent] = round(1 - deltas["llm"] / total, 3) if total else None
+    return share
+
+
+def compare_dispatch(workload, iterations):
+    """Microbenchmark: run_agents through LangGraph vs direct dispatch, sequentially, plus the same
+    two paths around no-op agent nodes (pure orchestration overhead)"""
+    import agents_run
+
+    noop_nodes = {name: (lambda state: state) for name in agents_run.AGENT_NODES}
+    noop_graph = agents_run.build_workflow(noop_nodes)
+    paths = {
+        "langgraph": lambda query: agents_run.run_agents(query, mode="langgraph"),
+        "direct": lambda query: agents_run.run_agents(query, mode="direct"),
+        "langgraph_noop": lambda query: noop_graph.invoke({"query": query}),
+        "direct_noop": lambda query: agents_run.dispatch({"query": query}, noop_nodes),
+    }
+    queries = [workload[i % len(workload)] for i in range(iterations)]
+    samples = {name: [] for name in paths}
+    for query in queries:
+        for name, run in paths.items():  # interleaved, so drift affects every path alike
+            start = time.perf_counter()
+            run(query)
+            samples[name].append(time.perf_counter() - start)
+
+    report = {name: summarize(values) for name, values in samples.items()}
+    for name, values in samples.items():
+        report[name]["mean_us"] = round(sum(values) / len(values) * 1e6, 1)
+    report["overhead_saved_us"] = round(report["langgraph_noop"]["mean_us"] - report["direct_noop"]["mean_us"], 1)
+    return report
+
+
+def stress_concurrency(product_ids, threads, ops_per_thread):
+    """Hammer shared carts and orders from many threads and count lost updates (must be 0).
+
+    Cart: one user's cart is seeded with enough units that removals never empty a row, then every
+    thread mixes add_to_cart, add_items and remove_one on the same few products. Final quantities
+    must equal seed + adds - removes, and the cart_summaries row must match cart_items, both at
+    the end and in every add_items snapshot (read inside its own transaction). The same mix on
+    one cart per thread shows that different users don't wait for each other.
+    Orders: every thread cancels the same orders; each order may be canceled exactly once.
+    """
+    from order_agent import OrderAgent
+
+    pids = product_ids[:4]
+    seed = threads * ops_per_thread
+    ops = ("add", "add_many", "remove_one")
+
+    def mutate(agent, t):
+        delta, mismatches = Counter(), 0
+        for i in range(ops_per_thread):
+            pid, op = pids[(t + i) % len(pids)], ops[(t + i) % len(ops)]
+            if op == "add":
+                agent.add_to_cart(pid, 1)
+                delta[pid] += 1
+            elif op == "add_many":
+                result = agent.add_items([(pid, 2)])
+                mismatches += result["count"] != sum(item["quantity"] for item in result["cart"])
+                delta[pid] += 2
+            else:
+                agent.remove_one(pid)
+                delta[pid] -= 1
+        return delta, mismatches
+
+    def run_carts(agents):
+        for agent in set(agents):
+            agent.clear_cart()
+            agent.add_items([(pid, seed) for pid in pids])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            deltas = list(pool.map(mutate, agents, range(threads)))
+        seconds = time.perf_counter() - start
+
+        expected = defaultdict(Counter)
+        for agent, (delta, _) in zip(agents, deltas):
+            expected[agent.user_id].update(delta)
+        lost, summary_mismatches = 0, sum(mismatches for _, mismatches in deltas)
+        for agent in set(agents):
+            items, total, count = agent._fetch_cart()
+            actual = {item["productID"]: item["quantity"] for item in items}
+            lost += sum(abs(seed + expected[agent.user_id][pid] - actual.get(pid, 0)) for pid in pids)
+            if count != sum(actual.values()) or total != sum(item["item_total"] for item in items):
+                summary_mismatches += 1
+            agent.clear_cart()
+        return {"ops_per_s": round(threads * ops_per_thread / seconds, 1),
+                "lost_updates": lost, "summary_mismatches": summary_mismatches}
+
+    # Quantity cap raised so the seed plus every add fits; the check is about lost updates
+    max_quantity = seed + 2 * threads * ops_per_thread
+    shared = cart_agent.CartAgent(user_id="stress_shared", max_quantity=max_quantity)
+    report = {
+        "threads": threads,
+        "ops_per_thread": ops_per_thread,
+        "shared_cart": run_carts([shared] * threads),
+        "separate_carts": run_carts([cart_agent.CartAgent(user_id=f"stress_{t}", max_quantity=max_quantity)
+                                     for t in range(threads)]),
+    }
+
+    order_agent = OrderAgent(ORDERS_FILE)
+    cancelable = [oid for oid, order in order_agent.orders.items()
+                  if order["status"].lower() in ["processing", "shipped"]]
+    def cancel_all(_):
+        return sum("has been canceled" in order_agent.process_query(f"cancel order {oid}")["message"]
+                   for oid in cancelable)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        cancels = sum(pool.map(cancel_all, range(threads)))
+    report["orders"] = {"cancelable": len(cancelable), "successful_cancels": cancels}
+    report["passed"] = (
+        all(report[name]["lost_updates"] == 0 and report[name]["summary_mismatches"] == 0
+            for name in ("shared_cart", "separate_carts"))
+        and cancels == len(cancelable)
+    )
+    return report
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+# ===== Runner =====
+def run_benchmark(args):
+    products = generate_synthetic_catalog(args.products, seed=args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="happycart_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"📦 {len(products)} synthetic products → {workdir}")
+
+    build_workdir(workdir, products)
+    setup_database(args.schema, products)
+    install_fake_ollama(workdir, args.llm_latency_ms)
+
+    os.chdir(workdir)
+    try:
+        load_start = time.perf_counter()
+        import main  # agents load their indexes relative to the working directory
+        load_seconds = time.perf_counter() - load_start
+
+        faq_questions = read_faq_csv(FAQ_FILE)["question"].astype(str).tolist()
+        with open(ORDERS_FILE, "r", encoding="utf-8") as f:
+            order_ids = [o["order_id"] for o in json.load(f)]
+        workload = build_workload(args.requests, products, faq_questions, order_ids, args.seed)
+
+        for query in workload[:args.warmup]:
+            main.chat_endpoint(main.ChatRequest(query=query))
+
+        stage_samples = defaultdict(list)
+        def observe(stage, intent, seconds):
+            stage_samples[(stage, intent or "unknown")].append(seconds)
+        add_stage_observer(observe)
+
+        def timed_request(query):
+            start = time.perf_counter()
+            main.chat_endpoint(main.ChatRequest(query=query))
+            return time.perf_counter() - start
+
+        replies_before = reply_counts()
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = list(pool.map(timed_request, workload))
+        wall_seconds = time.perf_counter() - wall_start
+        replies_after = reply_counts()
+        remove_stage_observer(observe)
+
+        dispatch = compare_dispatch(workload, args.dispatch_iterations) if args.dispatch_iterations else None
+        stress = (stress_concurrency([p["product_id"] for p in products], args.stress_threads, args.stress_ops)
+                  if args.stress_threads else None)
+    finally:
+        if not args.keep:
+            drop_database(args.schema)
+
+    report = {
+        "config": {
+            "products": args.products, "requests": args.requests, "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms, "seed": args.seed,
+        },
+        "startup_seconds": round(load_seconds, 3),
+        "qps": round(len(workload) / wall_seconds, 2),
+        "end_to_end": summarize(latencies),
+        "stages": {f"{stage}/{intent}": summarize(values) for (stage, intent), values in sorted(stage_samples.items())},
+        "skipped_llm_share": generation_share(replies_before, replies_after),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if dispatch:
+        report["dispatch"] = dispatch
+    if stress:
+        report["stress"] = stress
+    return report
+
+
+def print_report(report):
+    print(f"\n🚀 QPS: {report['qps']}   startup: {report['startup_seconds']}s   peak RSS: {report['peak_rss_mb']} MB")
+    print(f"🧠 replies without LLM generation: {report['skipped_llm_share']}")
+    e2e = report["end_to_end"]
+    print(f"⏱️  end-to-end  p50 {e2e['p50_ms']} ms   p95 {e2e['p95_ms']} ms   p99 {e2e['p99_ms']} ms")
+    print(f"\n{'stage/intent':<32}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for name, s in report["stages"].items():
+        print(f"{name:<32}{s['count']:>8}{s['p50_ms']:>12}{s['p95_ms']:>12}{s['p99_ms']:>12}")
+
+    if "dispatch" in report:
+        dispatch = report["dispatch"]
+        print(f"\n{'dispatch path':<32}{'mean us':>12}{'p50 ms':>12}{'p95 ms':>12}")
+        for name in ("langgraph", "direct", "langgraph_noop", "direct_noop"):
+            d = dispatch[name]
+            print(f"{name:<32}{d['mean_us']:>12}{d['p50_ms']:>12}{d['p95_ms']:>12}")
+        print(f"⚡ direct dispatch saves {dispatch['overhead_saved_us']} us of orchestration per request")
+
+    if "stress" in report:
+        stress = report["stress"]
+        print(f"\n🔒 concurrency stress: {stress['threads']} threads x {stress['ops_per_thread']} cart ops")
+        for name in ("shared_cart", "separate_carts"):
+            c = stress[name]
+            print(f"{name:<32}{c['ops_per_s']:>10} ops/s   lost updates {c['lost_updates']}   "
+                  f"summary mismatches {c['summary_mismatches']}")
+        o = stress["orders"]
+        print(f"{'orders':<32}{o['successful_cancels']} successful cancels for {o['cancelable']} cancelable orders")
+        print("✅ no lost updates" if stress["passed"] else "❌ lost updates detected")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the HappyCart /chat pipeline")
+    parser.add_argument("--products", type=int, default=5000, help="synthetic catalog size")
+    parser.add_argument("--requests", type=int, default=1000, help="queries to replay")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument("--warmup", type=int, default=20, help="queries replayed before measuring")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="fake ollama reply latency")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--schema", default="happycart_bench", help="Postgres schema used for the run")
+    parser.add_argument("--workdir", help="directory for generated indexes (default: temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schema afterwards")
+    parser.add_argument("--output", help="write the JSON report here, for comparing runs")
+    parser.add_argument("--dispatch-iterations", type=int, default=0,
+                        help="also microbenchmark LangGraph vs direct dispatch over this many queries")
+    parser.add_argument("--stress-threads", type=int, default=0,
+                        help="also run the cart/order concurrency stress check with this many threads")
+    parser.add_argument("--stress-ops", type=int, default=50, help="cart operations per stress thread")
+    args = parser.parse_args()
+    # Resolve paths before the run changes into the work directory
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.workdir:
+        args.workdir = os.path.abspath(args.workdir)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report saved to {args.output}")
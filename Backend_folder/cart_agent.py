@@ -1,140 +1,372 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-# ===== DB Config =====
-DB_CONFIG = {
-    "dbname": "happycart",
-    "user": "happyuser",
-    "password": "happypass",
-    "host": "localhost",
-    "port": "5432"
-}
-
-class CartAgent:
-    def __init__(self, user_id="guest"):
-        self.user_id = user_id
-
-    def _get_connection(self):
-        return psycopg2.connect(**DB_CONFIG)
-
-    def _fetch_cart(self):
-        """Fetch full cart with details + total"""
-        with self._get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT c.product_id, p.title, p.description, p.price, p.image_url, c.quantity
-                    FROM cart_items c
-                    JOIN products p ON c.product_id = p.product_id
-                    WHERE c.user_id = %s
-                """, (self.user_id,))
-                rows = cur.fetchall()
-
-        cart_items, total_price = [], 0
-        for row in rows:
-            item_total = row["price"] * row["quantity"]
-            total_price += item_total
-            cart_items.append({
-                "productID": row["product_id"],  # keep API field as productID for frontend
-                "title": row["title"],
-                "description": row["description"],
-                "price": row["price"],
-                "image_url": row["image_url"],
-                "quantity": row["quantity"],
-                "item_total": item_total
-            })
-
-        return cart_items, total_price
-
-    def _make_response(self, message: str):
-        """Standardized response with cart + total"""
-        cart_items, total_price = self._fetch_cart()
-        return {
-            "message": message,
-            "cart": cart_items,
-            "total": total_price,
-            "count": sum(item["quantity"] for item in cart_items)
-        }
-
-    # === Add to Cart ===
-    def add_to_cart(self, productID, quantity=1):
-        if quantity <= 0:
-            return {"message": "⚠️ Quantity must be at least 1.", "cart": [], "total": 0, "count": 0}
-
-        with self._get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Check product exists
-                cur.execute("SELECT * FROM products WHERE product_id=%s", (productID,))
-                product = cur.fetchone()
-                if not product:
-                    return {"message": f"❌ Product {productID} not found.", "cart": [], "total": 0, "count": 0}
-
-                # Check if already in cart
-                cur.execute(
-                    "SELECT quantity FROM cart_items WHERE user_id=%s AND product_id=%s",
-                    (self.user_id, productID)
-                )
-                row = cur.fetchone()
-
-                if row:
-                    cur.execute(
-                        "UPDATE cart_items SET quantity = quantity + %s WHERE user_id=%s AND product_id=%s",
-                        (quantity, self.user_id, productID)
-                    )
-                else:
-                    cur.execute(
-                        "INSERT INTO cart_items (user_id, product_id, quantity) VALUES (%s, %s, %s)",
-                        (self.user_id, productID, quantity)
-                    )
-            conn.commit()
-
-        return self._make_response(f"✅ {product['title']} added to cart (Qty: {quantity}).")
-
-    # === View Cart ===
-    def view_cart(self):
-        cart_items, total_price = self._fetch_cart()
-        if not cart_items:
-            return {"message": "🛒 Your cart is empty.", "cart": [], "total": 0, "count": 0}
-        return self._make_response(f"🛒 You have {len(cart_items)} different products in your cart.")
-
-    # === Remove Entire Product from Cart ===
-    def remove_from_cart(self, productID):
-        with self._get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT * FROM cart_items WHERE user_id=%s AND product_id=%s", (self.user_id, productID))
-                row = cur.fetchone()
-                if not row:
-                    return self._make_response(f"⚠️ Product {productID} is not in your cart.")
-
-                cur.execute("DELETE FROM cart_items WHERE user_id=%s AND product_id=%s", (self.user_id, productID))
-            conn.commit()
-
-        return self._make_response(f"❌ Product {productID} removed from cart.")
-
-    # === Remove One Quantity ===
-    def remove_one(self, productID):
-        """Decrease quantity by 1, remove item if quantity becomes 0"""
-        with self._get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT quantity FROM cart_items WHERE user_id=%s AND product_id=%s",
-                            (self.user_id, productID))
-                row = cur.fetchone()
-                if not row:
-                    return self._make_response(f"⚠️ Product {productID} is not in your cart.")
-
-                if row["quantity"] > 1:
-                    cur.execute("UPDATE cart_items SET quantity = quantity - 1 WHERE user_id=%s AND product_id=%s",
-                                (self.user_id, productID))
-                else:
-                    cur.execute("DELETE FROM cart_items WHERE user_id=%s AND product_id=%s",
-                                (self.user_id, productID))
-            conn.commit()
-
-        return self._make_response(f"➖ Removed one unit of product {productID}.")
-
-    # === Clear Cart ===
-    def clear_cart(self):
-        with self._get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM cart_items WHERE user_id=%s", (self.user_id,))
-            conn.commit()
-        return {"message": "🗑️ Cart cleared.", "cart": [], "total": 0, "count": 0}
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import connection as PGConnection
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from locks import StripedLock
+from metrics import timed
+
+# ===== DB Config =====
+DB_CONFIG = {
+    "dbname": "happycart",
+    "user": "happyuser",
+    "password": "happypass",
+    "host": "localhost",
+    "port": "5432"
+}
+
+CART_POOL_MIN = 1
+CART_POOL_MAX = int(os.getenv("HAPPYCART_CART_POOL_MAX", 10))
+MAX_ITEM_QUANTITY = int(os.getenv("HAPPYCART_MAX_ITEM_QUANTITY", 99))  # units of one product in a cart
+
+# ===== Prepared Statements =====
+# name → (parameter types, SQL); prepared once per pooled connection, run with EXECUTE.
+# Every mutation first locks the user's cart_summaries row (`lock_cart`) and ends with
+# `refresh_summary` in the same transaction, so cart_summaries (see migrations.py) always
+# matches cart_items: without the row lock, two concurrent refreshes could each miss the
+# other's uncommitted change and the later one would overwrite the summary with a stale sum.
+PREPARED_STATEMENTS = {
+    "cart_summary_init": ("varchar",
+                          "INSERT INTO cart_summaries (user_id) VALUES ($1) ON CONFLICT (user_id) DO NOTHING"),
+    "lock_cart": ("varchar", "SELECT 1 FROM cart_summaries WHERE user_id = $1 FOR UPDATE"),
+    "cart_items": ("varchar", """
+        SELECT c.product_id, p.title, p.description, p.price, p.image_url, c.quantity
+        FROM cart_items c
+        JOIN products p ON c.product_id = p.product_id
+        WHERE c.user_id = $1
+        ORDER BY c.id
+    """),
+    "cart_summary": ("varchar", "SELECT item_count, total_price FROM cart_summaries WHERE user_id = $1"),
+    "product_title": ("varchar", "SELECT title FROM products WHERE product_id = $1"),
+    # Adds skip (rowcount 0 / missing from RETURNING) a row whose quantity would pass the cap ($4)
+    "cart_add": ("varchar, varchar, int, int", """
+        INSERT INTO cart_items (user_id, product_id, quantity) VALUES ($1, $2, $3)
+        ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+        WHERE cart_items.quantity + EXCLUDED.quantity <= $4
+    """),
+    "cart_decrement": ("varchar, varchar",
+                       "UPDATE cart_items SET quantity = quantity - 1 WHERE user_id = $1 AND product_id = $2 AND quantity > 1"),
+    "cart_remove": ("varchar, varchar", "DELETE FROM cart_items WHERE user_id = $1 AND product_id = $2"),
+    # Batched variants: one statement for a whole list of (product_id, quantity);
+    # unknown product IDs are dropped by the JOIN and missing from RETURNING
+    "cart_add_many": ("varchar, varchar[], int[], int", """
+        INSERT INTO cart_items (user_id, product_id, quantity)
+        SELECT $1, u.product_id, u.quantity
+        FROM unnest($2, $3) AS u(product_id, quantity)
+        JOIN products p ON p.product_id = u.product_id
+        ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+        WHERE cart_items.quantity + EXCLUDED.quantity <= $4
+        RETURNING product_id
+    """),
+    "cart_decrement_many": ("varchar, varchar[]", """
+        UPDATE cart_items SET quantity = quantity - 1
+        WHERE user_id = $1 AND product_id = ANY($2) AND quantity > 1
+        RETURNING product_id
+    """),
+    "cart_remove_many": ("varchar, varchar[]",
+                         "DELETE FROM cart_items WHERE user_id = $1 AND product_id = ANY($2) RETURNING product_id"),
+    "cart_clear": ("varchar", "DELETE FROM cart_items WHERE user_id = $1"),
+    "refresh_summary": ("varchar", """
+        INSERT INTO cart_summaries (user_id, item_count, total_price, updated_at)
+        SELECT $1, COALESCE(SUM(c.quantity), 0), COALESCE(SUM(c.quantity * p.price), 0), now()
+        FROM cart_items c
+        JOIN products p ON c.product_id = p.product_id
+        WHERE c.user_id = $1
+        ON CONFLICT (user_id) DO UPDATE
+        SET item_count = EXCLUDED.item_count, total_price = EXCLUDED.total_price, updated_at = EXCLUDED.updated_at
+    """),
+}
+
+
+class PreparedConnection(PGConnection):
+    """psycopg2 connection that remembers which statements it has PREPAREd"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises once all connections are out; callers wait for a free slot instead
+_pool_slots = threading.BoundedSemaphore(CART_POOL_MAX)
+
+# Per-user lock stripes: concurrent mutations of one cart wait here, in process, instead of
+# each holding a pooled connection while blocked on the cart's row lock
+_user_locks = StripedLock()
+
+
+def get_pool():
+    """Shared connection pool, created on first use (so DB_CONFIG can still be changed before that)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(CART_POOL_MIN, CART_POOL_MAX, connection_factory=PreparedConnection, **DB_CONFIG)
+        return _pool
+
+
+def execute(cur, name, params=()):
+    """EXECUTE a prepared statement, preparing it on this connection first if needed"""
+    conn = cur.connection
+    if name not in conn.prepared:
+        types, sql = PREPARED_STATEMENTS[name]
+        cur.execute(f"PREPARE {name} ({types}) AS {sql}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
+
+
+class CartAgent:
+    def __init__(self, user_id="guest", max_quantity=MAX_ITEM_QUANTITY):
+        self.user_id = user_id
+        self.max_quantity = max_quantity
+
+    @contextmanager
+    def _get_connection(self):
+        """Pooled connection; commits on success, rolls back on error"""
+        pool = get_pool()
+        with _pool_slots:
+            conn = pool.getconn()
+            broken = False
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                pool.putconn(conn, close=broken or bool(conn.closed))
+
+    @contextmanager
+    def _mutation(self):
+        """Connection for a cart mutation: serialized per user in this process (lock stripe) and
+        across processes (row lock on the user's cart_summaries row, held until commit)"""
+        with _user_locks.lock_for(self.user_id), self._get_connection() as conn:
+            with conn.cursor() as cur:
+                execute(cur, "lock_cart", (self.user_id,))
+                if cur.fetchone() is None:
+                    execute(cur, "cart_summary_init", (self.user_id,))
+                    execute(cur, "lock_cart", (self.user_id,))
+            yield conn
+
+    def _fetch_cart(self):
+        """Fetch full cart with details; total + count come from the cart summary row"""
+        with timed("db", "cart"), self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                return self._read_cart(cur)
+
+    def _read_cart(self, cur):
+        """Cart snapshot on an open cursor (so a mutation can return it from its own transaction)"""
+        execute(cur, "cart_items", (self.user_id,))
+        rows = cur.fetchall()
+        execute(cur, "cart_summary", (self.user_id,))
+        summary = cur.fetchone()
+
+        cart_items = []
+        for row in rows:
+            cart_items.append({
+                "productID": row["product_id"],  # keep API field as productID for frontend
+                "title": row["title"],
+                "description": row["description"],
+                "price": row["price"],
+                "image_url": row["image_url"],
+                "quantity": row["quantity"],
+                "item_total": row["price"] * row["quantity"]
+            })
+
+        if summary is None:
+            return cart_items, 0, 0
+        return cart_items, summary["total_price"], summary["item_count"]
+
+    def _make_response(self, message: str):
+        """Standardized response with cart + total"""
+        cart_items, total_price, count = self._fetch_cart()
+        return {
+            "message": message,
+            "cart": cart_items,
+            "total": total_price,
+            "count": count
+        }
+
+    # === Cart Badge ===
+    def summary(self):
+        """Item count + total for the cart badge: one primary-key lookup"""
+        with timed("db", "cart"), self._get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                execute(cur, "cart_summary", (self.user_id,))
+                row = cur.fetchone()
+        if row is None:
+            return {"count": 0, "total": 0}
+        return {"count": row["item_count"], "total": row["total_price"]}
+
+    # === Add to Cart ===
+    def add_to_cart(self, productID, quantity=1):
+        if quantity <= 0:
+            return {"message": "⚠️ Quantity must be at least 1.", "cart": [], "total": 0, "count": 0}
+        if quantity > self.max_quantity:
+            return {"message": f"⚠️ At most {self.max_quantity} units per product.", "cart": [], "total": 0, "count": 0}
+
+        with timed("db", "cart"), self._mutation() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # Check product exists
+                execute(cur, "product_title", (productID,))
+                product = cur.fetchone()
+                if not product:
+                    return {"message": f"❌ Product {productID} not found.", "cart": [], "total": 0, "count": 0}
+
+                # Insert, or bump the quantity if it is already in the cart and stays within the cap
+                execute(cur, "cart_add", (self.user_id, productID, quantity, self.max_quantity))
+                added = cur.rowcount > 0
+                if added:
+                    execute(cur, "refresh_summary", (self.user_id,))
+
+        if not added:
+            return self._make_response(
+                f"⚠️ {product['title']} not added: at most {self.max_quantity} units per product in the cart."
+            )
+        return self._make_response(f"✅ {product['title']} added to cart (Qty: {quantity}).")
+
+    # === Add Several Products ===
+    def add_items(self, items):
+        """Add [(productID, quantity), ...] with one batched upsert; the cart snapshot comes
+        from the same transaction"""
+        quantities = {}
+        for productID, quantity in items:
+            if quantity <= 0:
+                return {"message": f"⚠️ Quantity for {productID} must be at least 1.", "cart": [], "total": 0, "count": 0}
+            quantities[productID] = quantities.get(productID, 0) + quantity
+        if not quantities:
+            return {"message": "⚠️ No products to add.", "cart": [], "total": 0, "count": 0}
+        too_many = [pid for pid, quantity in quantities.items() if quantity > self.max_quantity]
+        if too_many:
+            return {"message": f"⚠️ At most {self.max_quantity} units per product: {', '.join(too_many)}.",
+                    "cart": [], "total": 0, "count": 0}
+
+        with timed("db", "cart"), self._mutation() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                execute(cur, "cart_add_many",
+                        (self.user_id, list(quantities), list(quantities.values()), self.max_quantity))
+                added = {row["product_id"] for row in cur.fetchall()}
+                if added:
+                    execute(cur, "refresh_summary", (self.user_id,))
+                cart_items, total_price, count = self._read_cart(cur)
+
+        titles = {item["productID"]: item["title"] for item in cart_items}
+        parts = []
+        if added:
+            listed = ", ".join(f"{titles.get(pid, pid)} x{qty}" for pid, qty in quantities.items() if pid in added)
+            parts.append(f"✅ Added to cart: {listed}.")
+        # A skipped product that is in the cart hit the cap; any other one does not exist
+        capped = [pid for pid in quantities if pid not in added and pid in titles]
+        if capped:
+            parts.append(f"⚠️ Not added, at most {self.max_quantity} units per product in the cart: "
+                         f"{', '.join(titles[pid] for pid in capped)}.")
+        missing = [pid for pid in quantities if pid not in added and pid not in titles]
+        if missing:
+            parts.append(f"❌ Not found: {', '.join(missing)}.")
+        return {"message": " ".join(parts), "cart": cart_items, "total": total_price, "count": count}
+
+    # === Remove Several Products ===
+    def remove_items(self, productIDs):
+        """Remove the given products entirely, in one statement and one transaction"""
+        productIDs = list(dict.fromkeys(productIDs))
+        if not productIDs:
+            return {"message": "⚠️ No products to remove.", "cart": [], "total": 0, "count": 0}
+        with timed("db", "cart"), self._mutation() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                execute(cur, "cart_remove_many", (self.user_id, productIDs))
+                removed = {row["product_id"] for row in cur.fetchall()}
+                if removed:
+                    execute(cur, "refresh_summary", (self.user_id,))
+                cart_items, total_price, count = self._read_cart(cur)
+
+        parts = []
+        if removed:
+            parts.append(f"❌ Removed from cart: {', '.join(pid for pid in productIDs if pid in removed)}.")
+        missing = [pid for pid in productIDs if pid not in removed]
+        if missing:
+            parts.append(f"⚠️ Not in your cart: {', '.join(missing)}.")
+        return {"message": " ".join(parts), "cart": cart_items, "total": total_price, "count": count}
+
+    # === View Cart ===
+    def view_cart(self):
+        cart_items, total_price, count = self._fetch_cart()
+        if not cart_items:
+            return {"message": "🛒 Your cart is empty.", "cart": [], "total": 0, "count": 0}
+        return {
+            "message": f"🛒 You have {len(cart_items)} different products in your cart.",
+            "cart": cart_items,
+            "total": total_price,
+            "count": count
+        }
+
+    # === Remove Entire Product from Cart ===
+    def remove_from_cart(self, productID):
+        with timed("db", "cart"), self._mutation() as conn:
+            with conn.cursor() as cur:
+                execute(cur, "cart_remove", (self.user_id, productID))
+                removed = cur.rowcount > 0
+                if removed:
+                    execute(cur, "refresh_summary", (self.user_id,))
+
+        if not removed:
+            return self._make_response(f"⚠️ Product {productID} is not in your cart.")
+        return self._make_response(f"❌ Product {productID} removed from cart.")
+
+    # === Remove One Quantity ===
+    def remove_one(self, productID):
+        """Decrease quantity by 1, remove item if quantity becomes 0"""
+        with timed("db", "cart"), self._mutation() as conn:
+            with conn.cursor() as cur:
+                execute(cur, "cart_decrement", (self.user_id, productID))
+                removed = cur.rowcount > 0
+                if not removed:
+                    # Quantity was 1 (or the item is missing): drop the row
+                    execute(cur, "cart_remove", (self.user_id, productID))
+                    removed = cur.rowcount > 0
+                if removed:
+                    execute(cur, "refresh_summary", (self.user_id,))
+
+        if not removed:
+            return self._make_response(f"⚠️ Product {productID} is not in your cart.")
+        return self._make_response(f"➖ Removed one unit of product {productID}.")
+
+    # === Remove One Quantity of Several Products ===
+    def remove_one_items(self, productIDs):
+        """Decrease each product's quantity by 1 (dropping rows at 1), in one transaction"""
+        productIDs = list(dict.fromkeys(productIDs))
+        if not productIDs:
+            return {"message": "⚠️ No products to remove.", "cart": [], "total": 0, "count": 0}
+        with timed("db", "cart"), self._mutation() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                execute(cur, "cart_decrement_many", (self.user_id, productIDs))
+                removed = {row["product_id"] for row in cur.fetchall()}
+                rest = [pid for pid in productIDs if pid not in removed]
+                if rest:
+                    # Quantity was 1 (or the item is missing): drop the rows
+                    execute(cur, "cart_remove_many", (self.user_id, rest))
+                    removed.update(row["product_id"] for row in cur.fetchall())
+                if removed:
+                    execute(cur, "refresh_summary", (self.user_id,))
+                cart_items, total_price, count = self._read_cart(cur)
+
+        parts = []
+        if removed:
+            parts.append(f"➖ Removed one unit of: {', '.join(pid for pid in productIDs if pid in removed)}.")
+        missing = [pid for pid in productIDs if pid not in removed]
+        if missing:
+            parts.append(f"⚠️ Not in your cart: {', '.join(missing)}.")
+        return {"message": " ".join(parts), "cart": cart_items, "total": total_price, "count": count}
+
+    # === Clear Cart ===
+    def clear_cart(self):
+        with timed("db", "cart"), self._mutation() as conn:
+            with conn.cursor() as cur:
+                execute(cur, "cart_clear", (self.user_id,))
+                execute(cur, "refresh_summary", (self.user_id,))
+        return {"message": "🗑️ Cart cleared.", "cart": [], "total": 0, "count": 0}
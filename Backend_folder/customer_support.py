@@ -1,69 +1,146 @@
-import pandas as pd
-import faiss
-import numpy as np
-import re
-from sentence_transformers import SentenceTransformer
-
-# ===== Config =====
-FAQ_FILE = "faqs_and_policies.csv"   # Updated UTF-8/Excel supported file
-EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  
-TOP_K = 1  # Top match
-
-class CustomerSupportAgent:
-    def __init__(self, faq_file, embedding_model):
-        # ---- Load Excel or CSV robustly ----
-        try:
-            if faq_file.endswith(".xlsx"):
-                self.df = pd.read_excel(faq_file)
-            else:
-                # Auto-detect delimiter (comma, tab, semicolon)
-                self.df = pd.read_csv(faq_file, encoding="utf-8-sig", sep=None, engine="python")
-        except Exception as e:
-            print(f"⚠️ UTF-8 failed: {e} → Retrying with latin1...")
-            self.df = pd.read_csv(faq_file, encoding="latin1", sep=None, engine="python")
-
-        # Normalize column names
-        self.df.columns = [c.strip().lower() for c in self.df.columns]
-
-        if not {"question", "answer"}.issubset(set(self.df.columns)):
-            raise ValueError("CSV/Excel must have 'question' and 'answer' columns")
-
-        # ---- Embedding setup ----
-        self.embedder = SentenceTransformer(embedding_model)
-        self.questions = self.df["question"].astype(str).tolist()
-        self.answers = self.df["answer"].astype(str).tolist()
-        print(f"📄 Loaded {len(self.questions)} FAQs/Policies")
-
-        self.embeddings = self.embedder.encode(self.questions).astype("float32")
-
-        # ---- FAISS index ----
-        dim = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dim)
-        self.index.add(self.embeddings)
-
-    def search(self, query):
-        print(f"\n💬 User Query: {query}")
-        query_emb = self.embedder.encode([query]).astype("float32")
-        scores, indices = self.index.search(query_emb, TOP_K)
-
-        best_score = scores[0][0]
-        best_idx = indices[0][0]
-
-        if best_idx < 0 or best_score > 1.5:  # 1.5 is arbitrary threshold for poor matches
-            print("❌ No relevant FAQ/Policy found.")
-            return None
-
-        best_q = self.questions[best_idx]
-        best_a = self.answers[best_idx]
-        print(f"✅ Matched FAQ: {best_q}")
-        print(f"📜 Answer: {best_a}")
-        return {"question": best_q, "answer": best_a}
-
-
-if __name__ == "__main__":
-    agent = CustomerSupportAgent(FAQ_FILE, EMBEDDING_MODEL)
-    while True:
-        q = input("\nAsk your question (or 'exit'): ")
-        if q.lower() == "exit":
-            break
-        agent.search(q)
+import os
+import pandas as pd
+import numpy as np
+import re
+from embedder import load_embedder
+from metrics import timed, log_event
+from quantization import build_index
+
+# ===== Config =====
+FAQ_FILE = "faqs_and_policies.csv"   # Updated UTF-8/Excel supported file
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  
+TOP_K = 1  # Top match
+MAX_DISTANCE = 1.5  # L2 distance above which a semantic match counts as poor
+TOKEN_MATCH_MIN_SIMILARITY = 0.8  # token-set Jaccard needed to answer without embedding the query
+NEGATIONS = frozenset({"not", "no", "never", "t", "cannot", "without"})  # "don't" normalizes to "don t"
+FAQ_QUANTIZATION = os.getenv("HAPPYCART_FAQ_QUANTIZATION", "none")  # none | fp16 | int8
+
+
+def normalize_text(text):
+    """Lowercase, drop punctuation and collapse whitespace, so typed questions match the CSV"""
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text).lower()).split())
+
+
+class CustomerSupportAgent:
+    def __init__(self, faq_file, embedding_model, quantization=FAQ_QUANTIZATION):
+        # ---- Load Excel or CSV robustly ----
+        try:
+            if faq_file.endswith(".xlsx"):
+                self.df = pd.read_excel(faq_file)
+            else:
+                # Auto-detect delimiter (comma, tab, semicolon)
+                self.df = pd.read_csv(faq_file, encoding="utf-8-sig", sep=None, engine="python")
+        except Exception as e:
+            print(f"⚠️ UTF-8 failed: {e} → Retrying with latin1...")
+            self.df = pd.read_csv(faq_file, encoding="latin1", sep=None, engine="python")
+
+        # Normalize column names
+        self.df.columns = [c.strip().lower() for c in self.df.columns]
+
+        if not {"question", "answer"}.issubset(set(self.df.columns)):
+            raise ValueError("CSV/Excel must have 'question' and 'answer' columns")
+
+        # ---- Embedding setup ----
+        self.embedder = load_embedder(embedding_model)
+        self.questions = self.df["question"].astype(str).tolist()
+        self.answers = self.df["answer"].astype(str).tolist()
+        log_event("faqs_loaded", sampled=False, count=len(self.questions))
+
+        self.embeddings = self.embedder.encode(self.questions).astype("float32")
+
+        # ---- FAISS index ----
+        dim = self.embeddings.shape[1]
+        self.index = build_index(dim, quantization)
+        if not self.index.is_trained:
+            self.index.train(self.embeddings)
+        self.index.add(self.embeddings)
+
+        # ---- Exact / token-set lookup (no transformer) ----
+        self.exact_index = {}
+        self.token_sets = []
+        self.token_index = {}
+        for i, question in enumerate(self.questions):
+            normalized = normalize_text(question)
+            self.exact_index.setdefault(normalized, i)
+            tokens = frozenset(normalized.split())
+            self.token_sets.append(tokens)
+            for token in tokens:
+                self.token_index.setdefault(token, []).append(i)
+
+    def faq_result(self, idx, score, match):
+        return {"question": self.questions[idx], "answer": self.answers[idx], "score": score, "match": match}
+
+    def lookup(self, query):
+        """Exact normalized match, else the best token-set (Jaccard) match above the threshold.
+
+        A question differing from the query by a negation ("... is not delayed") is never a
+        token match. Returns (faq index, score) with score = 1 - similarity (0.0 for an exact
+        match), or None.
+        """
+        normalized = normalize_text(query)
+        if normalized in self.exact_index:
+            return self.exact_index[normalized], 0.0
+
+        tokens = frozenset(normalized.split())
+        candidates = {i for token in tokens for i in self.token_index.get(token, ())}
+        best_idx, best_similarity = None, 0.0
+        for i in sorted(candidates):
+            if (tokens ^ self.token_sets[i]) & NEGATIONS:
+                continue
+            similarity = len(tokens & self.token_sets[i]) / len(tokens | self.token_sets[i])
+            if similarity > best_similarity:
+                best_idx, best_similarity = i, similarity
+        if best_idx is None or best_similarity < TOKEN_MATCH_MIN_SIMILARITY:
+            return None
+        return best_idx, 1.0 - best_similarity
+
+    def search_top_k(self, query, top_k=TOP_K, max_distance=MAX_DISTANCE):
+        """Up to `top_k` FAQ matches: the lookup hit (if any) first, then semantic matches by distance.
+
+        An exact or near-exact question is answered from the lookup tables ("exact" / "token",
+        score = 1 - token similarity); only when more matches are needed, or there is no such hit,
+        is the query embedded and searched ("semantic", score = L2 distance, at most `max_distance`).
+        The two kinds of score are not comparable: check `match` before reading `score`.
+        """
+        with timed("filter", "support"):
+            hit = self.lookup(query)
+        matches = []
+        if hit is not None:
+            idx, score = hit
+            matches.append(self.faq_result(idx, score, "exact" if score == 0.0 else "token"))
+            if top_k <= 1:
+                return matches
+
+        with timed("embed", "support"):
+            query_emb = self.embedder.encode([query]).astype("float32")
+        with timed("vector_search", "support"):
+            # one extra neighbour: the lookup hit, if any, is usually among them and gets skipped
+            scores, indices = self.index.search(query_emb, top_k + (hit is not None))
+
+        seen = {hit[0]} if hit is not None else set()
+        for score, idx in zip(scores[0], indices[0]):
+            if idx < 0 or score > max_distance or idx in seen or len(matches) >= top_k:
+                continue
+            seen.add(idx)
+            matches.append(self.faq_result(idx, float(score), "semantic"))
+        return matches
+
+    def search(self, query):
+        matches = self.search_top_k(query, top_k=1)
+        if not matches:
+            log_event("support_search", query=query, matched=False)
+            return None
+
+        best = matches[0]
+        log_event("support_search", query=query, matched=True, question=best["question"],
+                  score=best["score"], match=best["match"])
+        return best
+
+
+if __name__ == "__main__":
+    agent = CustomerSupportAgent(FAQ_FILE, EMBEDDING_MODEL)
+    while True:
+        q = input("\nAsk your question (or 'exit'): ")
+        if q.lower() == "exit":
+            break
+        agent.search(q)
@@ -1,60 +1,9 @@
-import pandas as pd
-import random
+import argparse
 import json
+import os
 
-# Load your Excel file (make sure the file path is correct)
-df = pd.read_excel("products.xlsx")
-
-# Mapping for singular/plural consistency
-category_mapping = {
-    "shoe": "shoes",
-    "shoes": "shoes",
-    "jean": "jeans",
-    "jeans": "jeans",
-    "shirt": "shirts",
-    "shirts": "shirts",
-    "sunglass": "sunglasses",
-    "sunglasses": "sunglasses"
-}
-
-# Sample product titles and descriptions
-sample_titles = {
-    "shoes": ["Classic White Sneakers", "Running Sports Shoes", "Leather Formal Shoes"],
-    "jeans": ["Slim Fit Blue Jeans", "Distressed Black Denim", "High Waist Skinny Jeans"],
-    "shirts": ["Cotton Casual Shirt", "Formal White Shirt", "Plaid Flannel Shirt"],
-    "sunglasses": ["Aviator Sunglasses", "Round Vintage Shades", "Sporty UV Sunglasses"]
-}
-
-sample_descriptions = {
-    "shoes": "Comfortable and stylish footwear perfect for everyday wear.",
-    "jeans": "Trendy and durable jeans designed for comfort and style.",
-    "shirts": "High-quality shirts suitable for both casual and formal occasions.",
-    "sunglasses": "UV-protected stylish sunglasses ideal for all seasons."
-}
-
-# Generate additional fields
-def generate_product_data(row):
-    raw_category = str(row.get('category', '')).strip().lower()
-    category = category_mapping.get(raw_category, "shoes")  # fallback to 'shoes'
-    row['category'] = category
-    row['title'] = random.choice(sample_titles[category])
-    row['description'] = sample_descriptions[category]
-    row['price'] = random.randint(1500, 8000)  # price in PKR
-    row['stock'] = random.randint(10, 100)
-    return row
-
-# Apply the data generation
-df = df.apply(generate_product_data, axis=1)
-
-# Rename for consistency if needed
-df.rename(columns={'Image_url': 'image_url'}, inplace=True)
-
+import numpy as np
 import pandas as pd
-import random
-import json
-
-# Load your Excel file (make sure the file path is correct)
-df = pd.read_excel("products.xlsx")
 
 # Mapping for singular/plural consistency
 category_mapping = {
@@ -83,52 +32,154 @@ sample_descriptions = {
     "sunglasses": "UV-protected stylish sunglasses ideal for all seasons."
 }
 
-# Generate additional fields
-def generate_product_data(row):
-    raw_category = str(row.get('category', '')).strip().lower()
-    category = category_mapping.get(raw_category, "shoes")  
-    row['category'] = category
-    row['title'] = random.choice(sample_titles[category])
-    row['description'] = sample_descriptions[category]
-    row['price'] = random.randint(1500, 8000)
-    row['stock'] = random.randint(10, 100)
-    return row
-
-# Apply the data generation
-df = df.apply(generate_product_data, axis=1)
-
-# Rename for consistency if needed
-df.rename(columns={'Image_url': 'image_url'}, inplace=True)
-
-# ✅ Fix URLs (remove \/ issue if present)
-if 'image_url' in df.columns:
-    df["image_url"] = df["image_url"].astype(str).str.replace("\\\\/", "/", regex=True)
-
-# Reorder columns (keeping product_id from Excel)
-cols = ['product_id', 'title', 'description', 'category', 'price', 'stock']
-if 'image_url' in df.columns:
-    cols.append('image_url')
-df = df[cols]
-
-# Save to JSON (clean way, no \/ escaping)
-records = df.to_dict(orient="records")
-with open("products.json", "w", encoding="utf-8") as f:
-    json.dump(records, f, ensure_ascii=False, indent=2)
-
-print("✅ Files saved as products.json")
-
-if 'image_url' in df.columns:
-    df["image_url"] = df["image_url"].astype(str).str.replace("\\\\/", "/", regex=True)
-
-# Reorder columns (keeping product_id from Excel)
-cols = ['product_id', 'title', 'description', 'category', 'price', 'stock']
-if 'image_url' in df.columns:
-    cols.append('image_url')
-df = df[cols]
-
-# Save to JSON (clean way, no \/ escaping)
-records = df.to_dict(orient="records")
-with open("products.json", "w", encoding="utf-8") as f:
-    json.dump(records, f, ensure_ascii=False, indent=2)
-
-print("✅ Files saved as products.json")
+# Extra vocabulary for synthetic catalogs (benchmarks / load tests)
+synthetic_colors = ["Black", "White", "Red", "Blue", "Green", "Grey", "Brown", "Pink", "Yellow", "Purple"]
+synthetic_genders = ["Men's", "Women's", "Unisex"]
+category_weights = {"shoes": 0.35, "shirts": 0.3, "jeans": 0.2, "sunglasses": 0.15}
+category_price_ranges = {  # PKR
+    "shoes": (2500, 15000),
+    "shirts": (1200, 6000),
+    "jeans": (2000, 9000),
+    "sunglasses": (1500, 12000)
+}
+out_of_stock_share = 0.05
+
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/200"
+CATALOG_COLUMNS = ['product_id', 'title', 'description', 'category', 'price', 'stock', 'image_url']
+
+# Category-indexed lookup tables for vectorized generation
+_categories = np.array(list(sample_titles))
+_title_table = np.array([sample_titles[c] for c in _categories], dtype=object)
+_description_table = np.array([sample_descriptions[c] for c in _categories], dtype=object)
+
+
+def build_catalog_from_excel(excel_path="products.xlsx", seed=None):
+    # Load your Excel file (make sure the file path is correct)
+    df = pd.read_excel(excel_path)
+    rng = np.random.default_rng(seed)
+
+    # Generate additional fields (fallback category: 'shoes')
+    raw_category = df["category"] if "category" in df.columns else pd.Series("", index=df.index)
+    category = raw_category.astype(str).str.strip().str.lower().map(category_mapping).fillna("shoes")
+    codes = pd.Categorical(category, categories=_categories).codes
+    df['category'] = category
+    df['title'] = _title_table[codes, rng.integers(0, _title_table.shape[1], len(df))]
+    df['description'] = _description_table[codes]
+    df['price'] = rng.integers(1500, 8001, len(df))  # price in PKR
+    df['stock'] = rng.integers(10, 101, len(df))
+
+    # Rename for consistency if needed
+    df.rename(columns={'Image_url': 'image_url'}, inplace=True)
+
+    # ✅ Fix URLs (remove \/ issue if present)
+    if 'image_url' in df.columns:
+        df["image_url"] = df["image_url"].astype(str).str.replace("\\\\/", "/", regex=True)
+
+    # Reorder columns (keeping product_id from Excel)
+    cols = [c for c in CATALOG_COLUMNS if c in df.columns]
+    return df[cols].to_dict(orient="records")
+
+
+# ===== Synthetic Catalog =====
+def generate_product_chunk(rng, start, size, id_width=7):
+    """`size` synthetic products with IDs starting after `start`, built column-wise with NumPy"""
+    weights = np.array([category_weights[c] for c in _categories])
+    codes = rng.choice(len(_categories), size=size, p=weights / weights.sum())
+    genders = np.array(synthetic_genders, dtype=object)[rng.integers(0, len(synthetic_genders), size)]
+    colors = np.array(synthetic_colors, dtype=object)[rng.integers(0, len(synthetic_colors), size)]
+    base_titles = _title_table[codes, rng.integers(0, _title_table.shape[1], size)]
+
+    lows = np.array([category_price_ranges[c][0] for c in _categories])[codes]
+    highs = np.array([category_price_ranges[c][1] for c in _categories])[codes]
+    prices = np.maximum(rng.integers(lows, highs + 1) // 50 * 50 - 1, lows)  # e.g. 2499
+    stock = np.where(rng.random(size) < out_of_stock_share, 0, rng.integers(5, 250, size))
+
+    ids = np.char.add("P", np.char.zfill(np.arange(start + 1, start + size + 1).astype(str), id_width))
+    return pd.DataFrame({
+        "product_id": ids.astype(object),
+        "title": genders + " " + colors + " " + base_titles,
+        "description": _description_table[codes],
+        "category": _categories[codes].astype(object),
+        "price": prices,
+        "stock": stock,
+        "image_url": PLACEHOLDER_IMAGE
+    }, columns=CATALOG_COLUMNS)
+
+
+def iter_synthetic_catalog(num_products, chunk_size=100_000, seed=42):
+    """Yield the synthetic catalog as DataFrame chunks; same seed → same catalog"""
+    rng = np.random.default_rng(seed)
+    id_width = max(6, len(str(num_products)))
+    for start in range(0, num_products, chunk_size):
+        yield generate_product_chunk(rng, start, min(chunk_size, num_products - start), id_width)
+
+
+def generate_synthetic_catalog(num_products, seed=42):
+    """Synthetic products in the products.json schema, with colors and genders in the titles
+    so every search filter gets exercised."""
+    records = []
+    for chunk in iter_synthetic_catalog(num_products, seed=seed):
+        records.extend(chunk.to_dict(orient="records"))
+    return records
+
+
+def _json_lines(chunk):
+    # pandas escapes "/" as "\/"; undo it like the Excel pipeline does for image URLs
+    return chunk.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n").replace("\\/", "/")
+
+
+def write_synthetic_catalog(path, num_products, chunk_size=100_000, seed=42):
+    """Stream a synthetic catalog to .jsonl, .parquet or .json chunk by chunk, so memory stays at one chunk"""
+    fmt = os.path.splitext(path)[1].lower()
+    chunks = iter_synthetic_catalog(num_products, chunk_size, seed)
+
+    if fmt == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = writer or pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer:
+                writer.close()
+        return
+
+    with open(path, "w", encoding="utf-8") as f:
+        if fmt == ".jsonl":
+            for chunk in chunks:
+                f.write(_json_lines(chunk) + "\n")
+        elif fmt == ".json":
+            f.write("[\n")
+            for i, chunk in enumerate(chunks):
+                f.write((",\n" if i else "") + _json_lines(chunk).replace("\n", ",\n"))
+            f.write("\n]\n")
+        else:
+            raise ValueError(f"Unsupported catalog format '{fmt}' (use .jsonl, .parquet or .json)")
+
+
+def save_products(records, path="products.json"):
+    # Save to JSON (clean way, no \/ escaping)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build products.json from products.xlsx, or generate a synthetic catalog")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="generate N synthetic products instead")
+    parser.add_argument("--out", default=None, help="output path (.json, .jsonl or .parquet)")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        out = args.out or "products.jsonl"
+        write_synthetic_catalog(out, args.synthetic, args.chunk_size, args.seed)
+        print(f"✅ {args.synthetic} synthetic products saved to {out}")
+    else:
+        out = args.out or "products.json"
+        save_products(build_catalog_from_excel("products.xlsx"), out)
+        print(f"✅ Files saved as {out}")
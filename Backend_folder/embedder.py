@@ -0,0 +1,251 @@
+"""
+Pluggable query embedder: PyTorch SentenceTransformer or an exported ONNX graph under ONNX Runtime.
+
+    python embedder.py --export               # export the model to embeddings/onnx (+ int8 copy)
+    python embedder.py --check onnx-int8      # cosine parity + latency against PyTorch
+
+The ONNX backend only needs onnxruntime + tokenizers at serving time, so torch is never imported.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from metrics import log_event
+
+# ===== Config =====
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDER_BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDER_BACKEND = os.getenv("HAPPYCART_EMBEDDER_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("HAPPYCART_ONNX_DIR", "embeddings/onnx")
+ONNX_THREADS = int(os.getenv("HAPPYCART_ONNX_THREADS", min(4, os.cpu_count() or 1)))
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model_int8.onnx"}
+ONNX_CONFIG_FILE = "embedder_config.json"
+ONNX_OPSET = 14
+
+PARITY_MIN_COSINE = {"onnx": 0.9999, "onnx-int8": 0.98}
+PARITY_TEXTS = [
+    "show me black sneakers for men",
+    "cheapest jeans",
+    "red sunglasses for women under 3000",
+    "what is your return policy?",
+    "how long does delivery take",
+    "track order 1023",
+    "Cotton Casual Shirt High-quality shirts suitable for both casual and formal occasions.",
+    "Aviator Sunglasses UV-protected stylish sunglasses ideal for all seasons.",
+]
+
+
+# ===== ONNX Runtime backend =====
+class OnnxEmbedder:
+    """SentenceTransformer-compatible `encode` on an exported transformer graph.
+
+    Tokenization uses the saved tokenizer.json; mean/CLS pooling and L2 normalization
+    are done in NumPy exactly as the original model's pooling modules do them.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=False, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_file = ONNX_FILES["onnx-int8" if quantized else "onnx"]
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dim"]
+
+    def encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        features = {
+            "input_ids": np.array([e.ids for e in encodings], dtype="int64"),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype="int64"),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype="int64"),
+        }
+        tokens = self.session.run(None, {name: features[name] for name in self.input_names})[0]
+
+        if self.config["pooling"] == "cls":
+            embeddings = tokens[:, 0]
+        else:
+            mask = features["attention_mask"][:, :, None].astype("float32")
+            embeddings = (tokens * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype("float32")
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, self.config["dim"]), dtype="float32")
+
+        # Sort by length so each batch pads to similar lengths, then restore input order
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.config["dim"]), dtype="float32")
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self.encode_batch([texts[i] for i in rows])
+        return embeddings[0] if single else embeddings
+
+
+def load_embedder(model_name=EMBEDDING_MODEL, backend=EMBEDDER_BACKEND, model_dir=ONNX_MODEL_DIR):
+    """Embedder for `backend`; falls back to PyTorch when no matching ONNX export exists"""
+    if backend not in EMBEDDER_BACKENDS:
+        raise ValueError(f"Unknown embedder backend '{backend}' (use one of {', '.join(EMBEDDER_BACKENDS)})")
+
+    if backend != "torch":
+        reason = None
+        config_path = os.path.join(model_dir, ONNX_CONFIG_FILE)
+        if not os.path.exists(os.path.join(model_dir, ONNX_FILES[backend])) or not os.path.exists(config_path):
+            reason = "not_exported"
+        else:
+            with open(config_path, "r", encoding="utf-8") as f:
+                if json.load(f).get("model_name") != model_name:
+                    reason = "model_mismatch"
+        if reason is None:
+            log_event("embedder_loaded", sampled=False, backend=backend, threads=ONNX_THREADS)
+            return OnnxEmbedder(model_dir, quantized=backend == "onnx-int8")
+        log_event("embedder_fallback", sampled=False, backend=backend, reason=reason, model_dir=model_dir)
+
+    from sentence_transformers import SentenceTransformer
+    log_event("embedder_loaded", sampled=False, backend="torch")
+    return SentenceTransformer(model_name)
+
+
+# ===== Export =====
+def export_onnx(model_name=EMBEDDING_MODEL, model_dir=ONNX_MODEL_DIR, quantize=True):
+    """Export the model's transformer to ONNX (dynamic batch/sequence axes), its tokenizer and
+    pooling config; with `quantize`, also write a dynamic int8-quantized copy of the graph."""
+    import inspect
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu").eval()
+    transformer, pooling = model[0], model[1]
+    pooling_config = pooling.get_config_dict()
+    pooling_mode = pooling_config.get("pooling_mode") or ("cls" if pooling_config.get("pooling_mode_cls_token") else "mean")
+    if pooling_mode not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode '{pooling_mode}' for ONNX export")
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.auto_model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            ).last_hidden_state
+
+    os.makedirs(model_dir, exist_ok=True)
+    sample = model.tokenizer(["a sample query", "another one"], padding=True, return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+    export_kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+    onnx_path = os.path.join(model_dir, ONNX_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer.auto_model),
+            tuple(sample[name] for name in input_names),
+            onnx_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+            **export_kwargs,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(onnx_path, os.path.join(model_dir, ONNX_FILES["onnx-int8"]), weight_type=QuantType.QInt8)
+
+    model.tokenizer.save_pretrained(model_dir)
+    config = {
+        "model_name": model_name,
+        "dim": getattr(model, "get_embedding_dimension", model.get_sentence_embedding_dimension)(),
+        "max_seq_length": model.max_seq_length,
+        "pooling": pooling_mode,
+        "normalize": any(type(module).__name__ == "Normalize" for module in model),
+        "pad_token": model.tokenizer.pad_token,
+        "pad_token_id": model.tokenizer.pad_token_id,
+    }
+    with open(os.path.join(model_dir, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+# ===== Parity check =====
+def median_encode_ms(embedder, texts, repeats=5):
+    """Median single-query encode latency over `texts`, after one warm-up pass"""
+    embedder.encode(texts[:1])
+    samples = []
+    for _ in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            embedder.encode([text])
+            samples.append((time.perf_counter() - start) * 1000)
+    return round(float(np.median(samples)), 3)
+
+
+def check_parity(model_name=EMBEDDING_MODEL, backend="onnx", model_dir=ONNX_MODEL_DIR, texts=PARITY_TEXTS):
+    """Cosine similarity between PyTorch and `backend` embeddings, plus import and query latency for both"""
+    start = time.perf_counter()
+    import onnxruntime  # noqa: F401
+    import tokenizers  # noqa: F401
+    onnx_import_s = time.perf_counter() - start
+    start = time.perf_counter()
+    from sentence_transformers import SentenceTransformer
+    torch_import_s = time.perf_counter() - start
+
+    reference = SentenceTransformer(model_name, device="cpu")
+    candidate = OnnxEmbedder(model_dir, quantized=backend == "onnx-int8")
+    expected = np.asarray(reference.encode(texts, normalize_embeddings=True), dtype="float32")
+    actual = candidate.encode(texts)
+    actual = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    cosines = (expected * actual).sum(axis=1)
+
+    return {
+        "backend": backend,
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "passed": bool(cosines.min() >= PARITY_MIN_COSINE[backend]),
+        "import_seconds": {"torch": round(torch_import_s, 3), backend: round(onnx_import_s, 3)},
+        "query_ms_p50": {"torch": median_encode_ms(reference, texts), backend: median_encode_ms(candidate, texts)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedder to ONNX and check parity with PyTorch")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--export", action="store_true", help="export model.onnx (+ model_int8.onnx)")
+    parser.add_argument("--no-int8", action="store_true", help="skip the dynamic int8 quantized copy")
+    parser.add_argument("--check", choices=ONNX_FILES, help="compare this backend against PyTorch")
+    args = parser.parse_args()
+
+    if args.export:
+        config = export_onnx(args.model, args.model_dir, quantize=not args.no_int8)
+        print(f"✅ Exported {config['model_name']} (dim {config['dim']}, {config['pooling']} pooling) to {args.model_dir}")
+    if args.check:
+        report = check_parity(args.model, args.check, args.model_dir)
+        print(json.dumps(report, indent=2))
+        print("✅ Parity OK" if report["passed"] else f"❌ Cosine below {PARITY_MIN_COSINE[args.check]}")
+    if not (args.export or args.check):
+        parser.print_help()
@@ -1,140 +1,368 @@
-import json
-import pandas as pd
-import faiss
-import psycopg2
-from sentence_transformers import SentenceTransformer
-import numpy as np
-import os
-
-# === CONFIGURATION ===
-EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-PRODUCTS_PATH = "products.json"
-FAQ_PATH = "faqs_and_policies.csv"
-EMBEDDINGS_DIR = "embeddings"
-FAISS_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "faiss_index.index")
-ID_MAPPING_PATH = os.path.join(EMBEDDINGS_DIR, "id_mapping.json")
-
-# PostgreSQL credentials
-DB_CONFIG = {
-    "dbname": "happycart",
-    "user": "happyuser",
-    "password": "happypass",
-    "host": "localhost",
-    "port": "5432"
-}
-
-# === STEP 2: EMBEDDING GENERATION ===
-print("[Step 2] Generating Embeddings...")
-
-# Load product data
-with open(PRODUCTS_PATH, "r", encoding="utf-8") as f:
-    products = json.load(f)
-
-# Load FAQ/Policy data (handle encoding issues)
-try:
-    faq_df = pd.read_csv(FAQ_PATH, encoding="utf-8")
-except UnicodeDecodeError:
-    faq_df = pd.read_csv(FAQ_PATH, encoding="latin1")
-
-faq_df['content'] = faq_df['question'] + " " + faq_df['answer']  # Merge Q & A
-
-# Load embedding model
-model = SentenceTransformer(EMBED_MODEL)
-
-# Prepare product texts
-product_texts = [p['title'] + " " + p['description'] for p in products]
-product_ids = [p['product_id'] for p in products]  # FIX: changed from productID → product_id
-
-# Prepare FAQ texts
-faq_texts = faq_df['content'].tolist()
-faq_ids = faq_df['id'].astype(str).tolist()
-
-# Combine products + FAQs
-all_texts = product_texts + faq_texts
-all_ids = product_ids + faq_ids
-
-# Generate embeddings
-embeddings = model.encode(all_texts, show_progress_bar=True)
-embeddings = np.array(embeddings).astype("float32")
-
-# Create output directory
-os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
-
-# Save embeddings and ID mapping
-np.save(os.path.join(EMBEDDINGS_DIR, "embeddings.npy"), embeddings)
-with open(ID_MAPPING_PATH, "w", encoding="utf-8") as f:
-    json.dump(all_ids, f, ensure_ascii=False, indent=2)
-
-print("✅ Embeddings and ID mapping saved.")
-
-# === STEP 3: VECTOR STORE SETUP WITH FAISS ===
-print("[Step 3] Setting up FAISS index...")
-
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
-
-faiss.write_index(index, FAISS_INDEX_PATH)
-
-print(f"✅ FAISS index saved at: {FAISS_INDEX_PATH}")
-
-# === STEP 4: POSTGRESQL PRODUCT & CART DATABASE SETUP ===
-print("[Step 4] Inserting product data into PostgreSQL...")
-
-create_products_table = """
-CREATE TABLE IF NOT EXISTS products (
-    product_id VARCHAR PRIMARY KEY,
-    title TEXT,
-    description TEXT,
-    category TEXT,
-    price INT,
-    stock INT,
-    image_url TEXT
-);
-"""
-
-create_cart_table = """
-CREATE TABLE IF NOT EXISTS cart_items (
-    id SERIAL PRIMARY KEY,
-    user_id VARCHAR NOT NULL,
-    product_id VARCHAR REFERENCES products(product_id),
-    quantity INT DEFAULT 1
-);
-"""
-
-insert_product_query = """
-INSERT INTO products (product_id, title, description, category, price, stock, image_url)
-VALUES (%s, %s, %s, %s, %s, %s, %s)
-ON CONFLICT (product_id) DO NOTHING;
-"""
-
-# Connect to DB
-try:
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
-    # Create tables
-    cur.execute(create_products_table)
-    cur.execute(create_cart_table)
-    conn.commit()
-
-    # Insert products
-    for p in products:
-        cur.execute(insert_product_query, (
-            p['product_id'],  # FIXED key
-            p['title'],
-            p['description'],
-            p['category'],
-            p['price'],
-            p['stock'],
-            p['image_url']
-        ))
-
-    conn.commit()
-    print("✅ Products & Cart tables ready, products inserted successfully.")
-
-except Exception as e:
-    print("❌ Error during DB insertion:", e)
-finally:
-    if 'cur' in locals(): cur.close()
-    if 'conn' in locals(): conn.close()
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+
+import faiss
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
+from migrations import apply_migrations
+from sentence_transformers import SentenceTransformer
+
+from quantization import (
+    QUANTIZATION_MODES, STORAGE_DTYPES, TRAIN_SAMPLE_SIZE, QuantizedMatrix,
+    build_index as build_faiss_index, int8_params, measure_recall
+)
+
+# === CONFIGURATION ===
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+PRODUCTS_PATH = "products.json"   # .json array, .jsonl or .parquet
+FAQ_PATH = "faqs_and_policies.csv"
+EMBEDDINGS_DIR = "embeddings"
+FAISS_INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "faiss_index.index")
+ID_MAPPING_PATH = os.path.join(EMBEDDINGS_DIR, "id_mapping.json")
+EMBEDDINGS_PATH = os.path.join(EMBEDDINGS_DIR, "embeddings.npy")
+CHUNKS_DIR = os.path.join(EMBEDDINGS_DIR, "chunks")
+CHECKPOINT_PATH = os.path.join(EMBEDDINGS_DIR, "checkpoint.json")
+INDEX_META_PATH = os.path.join(EMBEDDINGS_DIR, "index_meta.json")
+
+CHUNK_SIZE = 10_000        # products read, encoded, saved and inserted per step
+ENCODE_BATCH_SIZE = 128
+JSON_READ_SIZE = 1 << 20   # bytes read at a time when streaming a .json array
+RECALL_SAMPLE_SIZE = 20_000  # vectors used to measure quantized recall against float32
+
+# PostgreSQL credentials
+DB_CONFIG = {
+    "dbname": "happycart",
+    "user": "happyuser",
+    "password": "happypass",
+    "host": "localhost",
+    "port": "5432"
+}
+
+create_products_table = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id VARCHAR PRIMARY KEY,
+    title TEXT,
+    description TEXT,
+    category TEXT,
+    price INT,
+    stock INT,
+    image_url TEXT
+);
+"""
+
+create_cart_table = """
+CREATE TABLE IF NOT EXISTS cart_items (
+    id SERIAL PRIMARY KEY,
+    user_id VARCHAR NOT NULL,
+    product_id VARCHAR REFERENCES products(product_id),
+    quantity INT DEFAULT 1
+);
+"""
+
+insert_products_query = """
+INSERT INTO products (product_id, title, description, category, price, stock, image_url)
+VALUES %s
+ON CONFLICT (product_id) DO NOTHING;
+"""
+
+
+# === STEP 1: STREAMING PRODUCT SOURCE ===
+def iter_json_array(f, read_size=JSON_READ_SIZE):
+    """Yield the objects of a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    while True:
+        # skip whitespace, the opening bracket and separators
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,[":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                if buffer[pos:].strip():
+                    raise
+                return
+            data = f.read(read_size)
+            eof = not data
+            buffer, pos = buffer[pos:] + data, 0
+            continue
+        yield obj
+        pos = end
+
+
+def iter_products(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=CHUNK_SIZE):
+            yield from batch.to_pylist()
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        if ext == ".jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+
+def iter_chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def product_text(p):
+    return p['title'] + " " + p['description']
+
+
+# === STEP 2: CHECKPOINTS ===
+def load_checkpoint(source, chunk_size, with_db):
+    """Number of chunks already finished for this source + chunk size + DB mode (0 if there is nothing to resume).
+
+    A --skip-db checkpoint never resumes a run that inserts into PostgreSQL (and vice versa):
+    its chunks were embedded but never inserted.
+    """
+    if not os.path.exists(CHECKPOINT_PATH):
+        return 0
+    with open(CHECKPOINT_PATH, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if (checkpoint.get("source") != os.path.abspath(source) or checkpoint.get("chunk_size") != chunk_size
+            or checkpoint.get("with_db") != with_db):
+        print("⚠️ Checkpoint belongs to a different source, chunk size or --skip-db setting → starting over.")
+        return 0
+    return checkpoint["completed_chunks"]
+
+
+def save_checkpoint(source, chunk_size, with_db, completed_chunks):
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "source": os.path.abspath(source),
+            "chunk_size": chunk_size,
+            "with_db": with_db,
+            "completed_chunks": completed_chunks
+        }, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)  # atomic: a crash leaves the previous checkpoint intact
+
+
+def chunk_paths(i):
+    return os.path.join(CHUNKS_DIR, f"chunk_{i:06d}.npy"), os.path.join(CHUNKS_DIR, f"chunk_{i:06d}.json")
+
+
+# === STEP 3: EMBEDDING GENERATION ===
+class Encoder:
+    """SentenceTransformer encoder, optionally spread over a pool of CPU worker processes"""
+
+    def __init__(self, model_name, workers=1):
+        self.model = SentenceTransformer(model_name)
+        self.pool = self.model.start_multi_process_pool(["cpu"] * workers) if workers > 1 else None
+
+    def encode(self, texts):
+        if self.pool:
+            embeddings = self.model.encode_multi_process(texts, self.pool, batch_size=ENCODE_BATCH_SIZE)
+        else:
+            embeddings = self.model.encode(texts, batch_size=ENCODE_BATCH_SIZE)
+        return np.asarray(embeddings, dtype="float32")
+
+    def close(self):
+        if self.pool:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+def load_faq_texts(path=FAQ_PATH):
+    # Load FAQ/Policy data (handle encoding issues)
+    try:
+        faq_df = pd.read_csv(path, encoding="utf-8")
+    except UnicodeDecodeError:
+        faq_df = pd.read_csv(path, encoding="latin1")
+    faq_df['content'] = faq_df['question'] + " " + faq_df['answer']  # Merge Q & A
+    return faq_df['content'].tolist(), faq_df['id'].astype(str).tolist()
+
+
+# === STEP 4: POSTGRESQL PRODUCT & CART TABLES ===
+def setup_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute(create_products_table)
+        cur.execute(create_cart_table)
+    conn.commit()
+    apply_migrations(conn)  # cart indexes/constraints + cart_summaries
+
+
+def insert_products(cur, products):
+    execute_values(cur, insert_products_query, [
+        (p['product_id'], p['title'], p['description'], p['category'], p['price'], p['stock'], p['image_url'])
+        for p in products
+    ])
+
+
+# === INGESTION ===
+def ingest_products(source, encoder, conn=None, chunk_size=CHUNK_SIZE):
+    """Stream `source` chunk by chunk: encode, save vectors + IDs to disk, insert into PostgreSQL,
+    then checkpoint. An interrupted run resumes after the last checkpointed chunk."""
+    os.makedirs(CHUNKS_DIR, exist_ok=True)
+    completed = load_checkpoint(source, chunk_size, conn is not None)
+    if completed:
+        print(f"↩️ Resuming after {completed} completed chunks.")
+
+    num_chunks = 0
+    for i, chunk in enumerate(iter_chunks(iter_products(source), chunk_size)):
+        num_chunks = i + 1
+        if i < completed:
+            continue
+
+        vectors_path, ids_path = chunk_paths(i)
+        np.save(vectors_path, encoder.encode([product_text(p) for p in chunk]))
+        with open(ids_path, "w", encoding="utf-8") as f:
+            json.dump([p['product_id'] for p in chunk], f, ensure_ascii=False)
+
+        if conn is not None:
+            with conn.cursor() as cur:
+                insert_products(cur, chunk)
+            conn.commit()
+
+        save_checkpoint(source, chunk_size, conn is not None, i + 1)
+        print(f"✅ Chunk {i + 1}: {len(chunk)} products embedded" + (" and inserted" if conn is not None else ""))
+
+    return num_chunks
+
+
+def iter_index_vectors(num_chunks, faq_vectors):
+    for i in range(num_chunks):
+        yield np.load(chunk_paths(i)[0])
+    yield faq_vectors
+
+
+def build_index(num_chunks, faq_vectors, faq_ids, quantization="none"):
+    """Assemble embeddings.npy, id_mapping.json, index_meta.json and the FAISS index from the saved
+    chunks, one chunk in memory at a time (products first, then FAQs).
+
+    With quantization "fp16" / "int8", embeddings.npy holds float16 values / int8 codes and the
+    index is an IndexScalarQuantizer; the recall@10 loss of searching the stored vectors against
+    float32 is measured on a random sample.
+    """
+    shapes = [np.load(chunk_paths(i)[0], mmap_mode="r").shape for i in range(num_chunks)]
+    dim = shapes[0][1] if shapes else faq_vectors.shape[1]
+    total = sum(rows for rows, _ in shapes) + len(faq_vectors)
+
+    # Random sample (not the first rows: sources are often sorted by category) for quantizer
+    # training and the recall check
+    rng = np.random.default_rng(0)
+    sample_rows = np.sort(rng.choice(total, size=min(TRAIN_SAMPLE_SIZE, total), replace=False))
+    sample, start = [], 0
+    for vectors in iter_index_vectors(num_chunks, faq_vectors):
+        lo, hi = np.searchsorted(sample_rows, [start, start + len(vectors)])
+        sample.append(np.asarray(vectors, dtype="float32")[sample_rows[lo:hi] - start])
+        start += len(vectors)
+    sample = rng.permutation(np.concatenate(sample))
+
+    int8_offset = int8_scale = None
+    if quantization == "int8":
+        lo = np.min([v.min(axis=0) for v in iter_index_vectors(num_chunks, faq_vectors) if len(v)], axis=0)
+        hi = np.max([v.max(axis=0) for v in iter_index_vectors(num_chunks, faq_vectors) if len(v)], axis=0)
+        int8_offset, int8_scale = int8_params(np.stack([lo, hi]))
+
+    all_embeddings = np.lib.format.open_memmap(
+        EMBEDDINGS_PATH, mode="w+", dtype=STORAGE_DTYPES[quantization], shape=(total, dim)
+    )
+    index = build_faiss_index(dim, quantization)
+    if not index.is_trained:
+        index.train(sample)
+    all_ids, offset = [], 0
+
+    for i, vectors in enumerate(iter_index_vectors(num_chunks, faq_vectors)):
+        if i < num_chunks:
+            with open(chunk_paths(i)[1], "r", encoding="utf-8") as f:
+                all_ids.extend(json.load(f))
+        else:
+            all_ids.extend(faq_ids)
+        all_embeddings[offset:offset + len(vectors)] = QuantizedMatrix.quantize(
+            vectors, quantization, int8_offset, int8_scale
+        ).data
+        index.add(vectors)
+        offset += len(vectors)
+    all_embeddings.flush()
+    del all_embeddings
+
+    recall = measure_recall(sample[:RECALL_SAMPLE_SIZE], quantization, int8_offset, int8_scale)
+    meta = {"quantization": quantization, "dim": int(dim), "count": int(total), "recall_at_10": round(recall, 4)}
+    if quantization == "int8":
+        meta["int8_offset"] = int8_offset.tolist()
+        meta["int8_scale"] = int8_scale.tolist()
+
+    with open(ID_MAPPING_PATH, "w", encoding="utf-8") as f:
+        json.dump(all_ids, f, ensure_ascii=False, indent=2)
+    with open(INDEX_META_PATH, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    faiss.write_index(index, FAISS_INDEX_PATH)
+    return index, meta
+
+
+def clear_checkpoint():
+    shutil.rmtree(CHUNKS_DIR, ignore_errors=True)
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate embeddings + FAISS index and load products into PostgreSQL")
+    parser.add_argument("--products", default=PRODUCTS_PATH, help="product source (.json, .jsonl or .parquet)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="encoder processes (1 = encode in this process)")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start from scratch")
+    parser.add_argument("--skip-db", action="store_true", help="only build embeddings, do not touch PostgreSQL")
+    parser.add_argument("--quantization", choices=QUANTIZATION_MODES, default="none",
+                        help="store and search vectors as float32 (none), float16 or int8")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    if args.restart:
+        clear_checkpoint()
+
+    conn = None
+    if not args.skip_db:
+        try:
+            conn = psycopg2.connect(**DB_CONFIG)
+            setup_tables(conn)
+        except Exception as e:
+            print("❌ Error during DB setup:", e)
+            sys.exit(1)
+
+    print(f"[Step 1] Streaming {args.products} in chunks of {args.chunk_size} ({args.workers} encoder processes)...")
+    encoder = Encoder(EMBED_MODEL, workers=args.workers)
+    try:
+        num_chunks = ingest_products(args.products, encoder, conn, args.chunk_size)
+        faq_texts, faq_ids = load_faq_texts(FAQ_PATH)
+        faq_vectors = encoder.encode(faq_texts)
+    finally:
+        encoder.close()
+        if conn is not None:
+            conn.close()
+
+    print("[Step 2] Building FAISS index from chunks...")
+    index, meta = build_index(num_chunks, faq_vectors, faq_ids, args.quantization)
+    clear_checkpoint()
+
+    print(f"✅ {index.ntotal} vectors indexed. FAISS index saved at: {FAISS_INDEX_PATH}")
+    if args.quantization != "none":
+        print(f"📉 {args.quantization} recall@10 vs float32: {meta['recall_at_10']}")
+    if conn is not None:
+        print("✅ Products & Cart tables ready, products inserted successfully.")
@@ -0,0 +1,168 @@
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Callable, Optional
+
+from metrics import LLM_COALESCED, LLM_SHED, observe_stage
+
+# ===== Config =====
+LLM_MAX_CONCURRENCY = int(os.getenv("HAPPYCART_LLM_MAX_CONCURRENCY", "4"))  # ollama processes at once
+LLM_MAX_QUEUE = int(os.getenv("HAPPYCART_LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_DEADLINE_S = float(os.getenv("HAPPYCART_LLM_QUEUE_DEADLINE_S", "5"))
+LLM_TIMEOUT_S = float(os.getenv("HAPPYCART_LLM_TIMEOUT_S", "60"))  # one generation, before it is abandoned
+LLM_INTENT_CONCURRENCY = {"product": 3, "support": 2, "order": 1}
+LLM_INTENT_PRIORITY = {"order": 0, "support": 1, "product": 2}  # lower value is served first
+
+
+class LLMOverloaded(Exception):
+    """Raised when a generation request is shed instead of queued"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def prompt_key(prompt: str) -> str:
+    """Key under which identical prompts (ignoring case and whitespace) share one generation"""
+    return hashlib.sha1(" ".join(prompt.lower().split()).encode("utf-8")).hexdigest()
+
+
+# ===== Single Flight =====
+class SingleFlight:
+    """Concurrent calls with the same key wait for the first caller's result instead of recomputing it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def do(self, key, fn, timeout=None):
+        """Returns (result, shared): shared is True when another caller's result was reused.
+
+        A caller waiting on another's result gives up after `timeout` seconds (FutureTimeout).
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        if not leader:
+            return future.result(timeout=timeout), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+# ===== Admission Control =====
+class AdmissionController:
+    """Bounded priority queue with a global and per-intent cap on running generations."""
+
+    def __init__(self, max_concurrency, intent_limits, priorities, max_queue):
+        self.max_concurrency = max_concurrency
+        self.intent_limits = intent_limits
+        self.priorities = priorities
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._active = defaultdict(int)
+        self._active_total = 0
+        self._waiting = []  # heap of (priority, seq, intent)
+        self._seq = itertools.count()
+
+    def _has_capacity(self, intent):
+        limit = self.intent_limits.get(intent, self.max_concurrency)
+        return self._active_total < self.max_concurrency and self._active[intent] < limit
+
+    def _next_runnable(self):
+        """Highest-priority waiter whose intent has a free slot"""
+        for entry in sorted(self._waiting):
+            if self._has_capacity(entry[2]):
+                return entry
+        return None
+
+    def _leave_queue(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+
+    def acquire(self, intent, timeout):
+        """Block until a slot for `intent` is free; raises LLMOverloaded if the queue is full or `timeout` passes."""
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                raise LLMOverloaded("queue_full")
+            entry = (self.priorities.get(intent, len(self.priorities)), next(self._seq), intent)
+            heapq.heappush(self._waiting, entry)
+            deadline = time.monotonic() + timeout
+            while self._next_runnable() != entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._leave_queue(entry)
+                    self._cond.notify_all()
+                    raise LLMOverloaded("deadline")
+                self._cond.wait(remaining)
+            self._leave_queue(entry)
+            self._active[intent] += 1
+            self._active_total += 1
+            self._cond.notify_all()  # a lower-priority waiter of another intent may still fit
+
+    def release(self, intent):
+        with self._cond:
+            self._active[intent] -= 1
+            self._active_total -= 1
+            self._cond.notify_all()
+
+
+# ===== Gateway =====
+class LLMGateway:
+    """Front door for LLM calls: coalesces identical prompts, then queues them under admission control."""
+
+    def __init__(self, generate: Callable[[str, str], Optional[str]], admission: Optional[AdmissionController] = None,
+                 queue_deadline: float = LLM_QUEUE_DEADLINE_S, generate_timeout: float = LLM_TIMEOUT_S):
+        self._generate = generate
+        self._flight = SingleFlight()
+        self.admission = admission or AdmissionController(
+            LLM_MAX_CONCURRENCY, LLM_INTENT_CONCURRENCY, LLM_INTENT_PRIORITY, LLM_MAX_QUEUE
+        )
+        self.queue_deadline = queue_deadline
+        self.generate_timeout = generate_timeout
+
+    def generate(self, prompt: str, intent: str) -> Optional[str]:
+        """LLM reply for `prompt`, or None when the request was shed (caller falls back to a template).
+
+        A caller coalesced onto an identical prompt waits at most the queue deadline plus one
+        generation timeout, so a hung generation cannot pin every duplicate request's thread.
+        """
+        try:
+            text, shared = self._flight.do(prompt_key(prompt), lambda: self._admit_and_generate(prompt, intent),
+                                           timeout=self.queue_deadline + self.generate_timeout)
+        except FutureTimeout:
+            LLM_SHED.labels(intent=intent, reason="coalesced_timeout").inc()
+            return None
+        if shared:
+            LLM_COALESCED.labels(intent=intent).inc()
+        return text
+
+    def _admit_and_generate(self, prompt, intent):
+        start = time.perf_counter()
+        try:
+            self.admission.acquire(intent, self.queue_deadline)
+        except LLMOverloaded as e:
+            LLM_SHED.labels(intent=intent, reason=e.reason).inc()
+            return None
+        finally:
+            observe_stage("llm_queue", intent, time.perf_counter() - start)
+        try:
+            return self._generate(prompt, intent)
+        finally:
+            self.admission.release(intent)
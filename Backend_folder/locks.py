@@ -0,0 +1,27 @@
+import os
+import threading
+import zlib
+
+# ===== Config =====
+LOCK_STRIPES = int(os.getenv("HAPPYCART_LOCK_STRIPES", "64"))
+
+
+class StripedLock:
+    """Fixed set of locks shared by many keys (user IDs, order IDs).
+
+    A key always maps to the same stripe, so read-modify-write sequences on one key are
+    serialized while other keys proceed in parallel, without a lock object per key or a
+    global lock. Hold only one stripe at a time: two stripes taken in different orders deadlock.
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def stripe(self, key) -> int:
+        return zlib.crc32(str(key).encode("utf-8")) % len(self._locks)
+
+    def lock_for(self, key) -> threading.Lock:
+        return self._locks[self.stripe(key)]
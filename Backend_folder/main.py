@@ -1,142 +1,273 @@
-import subprocess
-from fastapi import FastAPI
-from pydantic import BaseModel
-from agents_run import run_agents
-from fastapi.middleware.cors import CORSMiddleware
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# === Configurable Fallback Messages ===
-FALLBACK_MESSAGES = {
-    "product": lambda query: (
-        f"Sorry, we couldn’t find any products matching your request: \"{query}\". "
-        "Please try a different search or adjust your filters."
-    ),
-    "order": (
-        "Sorry, we couldn’t find any details for your order. "
-        "Please make sure you’ve entered the correct order number."
-    ),
-    "support": (
-        "Sorry, we couldn’t find any information for your request. "
-        "Please provide more details so we can assist you better."
-    ),
-    "cart": {
-        "message": "🛒 Your cart is empty or the action could not be completed.",
-        "cart": [],
-        "total": 0
-    }
-}
-
-# === Models ===
-class ChatRequest(BaseModel):
-    query: str
-
-# === Helper: Remove unwanted prefixes from LLM output ===
-def clean_response(text: str) -> str:
-    remove_prefixes = (
-        "customer question:",
-        "support response:",
-        "here's a sample response:",
-        "here's a polite and helpful",
-    )
-    lines = text.splitlines()
-    cleaned = [
-        line.strip()
-        for line in lines
-        if not any(line.strip().lower().startswith(p) for p in remove_prefixes)
-    ]
-    return " ".join(cleaned).strip()
-
-# === Call LLaMA 3 safely ===
-def llama_response(prompt: str) -> str:
-    try:
-        result = subprocess.run(
-            ["ollama", "run", "llama3", prompt],
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace"
-        )
-        return clean_response(result.stdout.strip())
-    except Exception as e:
-        print(f"LLaMA Error: {e}")
-        return "Sorry, something went wrong while processing your request."
-
-# === Chat Endpoint ===
-@app.post("/chat")
-def chat_endpoint(req: ChatRequest):
-    raw_result = run_agents(req.query)
-    intent = raw_result.get("intent", "")
-
-    payload = {
-        "type": intent,
-        "products": raw_result.get("products", []),
-        "message": raw_result.get("message", ""),
-        "order": None,
-        "support": None,
-        "cart": raw_result.get("cart", []),
-        "search_query": req.query,
-        "total": raw_result.get("total", 0)
-    }
-
-    # ================= PRODUCT INTENT =================
-    if intent == "product":
-        products_list = raw_result.get("products", [])
-        if products_list:
-            payload["message"] = llama_response(
-                f"Answer naturally and briefly. "
-                f"Recommend or describe these products in a clear way for this query: {req.query}. "
-                f"Products: {products_list}"
-            )
-        else:
-            payload["message"] = FALLBACK_MESSAGES["product"](req.query)
-
-    # ================= CART INTENT =================
-    elif intent == "cart":
-        if payload["cart"]:
-            payload["message"] = ""   # silent → no chatbot reply
-        else:
-            payload["message"] = FALLBACK_MESSAGES["cart"]["message"]
-
-    # ================= ORDER INTENT =================
-    elif intent == "order":
-        payload["order"] = raw_result
-        if raw_result:
-            payload["message"] = llama_response(
-                f"You are an order assistant for HappyCart. "
-                f"Give a simple, clear update about this order info: {raw_result}. "
-                f"Reply naturally without role labels or formal templates."
-            )
-        else:
-            payload["message"] = FALLBACK_MESSAGES["order"]
-
-    # ================= SUPPORT INTENT =================
-    elif intent == "support":
-        payload["support"] = raw_result
-        if raw_result:
-            payload["message"] = llama_response(
-                f"You are a customer support assistant for HappyCart. "
-                f"Answer the user’s question naturally and clearly based on this info: {raw_result}. "
-                f"Do not include phrases like 'here’s a response'. Just reply directly."
-            )
-        else:
-            payload["message"] = FALLBACK_MESSAGES["support"]
-
-    # ================= UNKNOWN INTENT =================
-    else:
-        payload["type"] = "unknown"
-        payload["message"] = (
-            "Sorry, I’m not sure how to handle that request. "
-            "Please try rephrasing or provide more details."
-        )
-
-    print("🔵 Backend Response:", payload)   # DEBUG
-    return payload
+import hmac
+import os
+import subprocess
+import time
+from typing import Annotated, List, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+from agents_run import (
+    CatalogReloadInProgress, bulk_cart, cart_summary, reload_catalog, run_agents, search_products_batch, suggest
+)
+from prompts import build_prompt
+from llm_gateway import LLM_TIMEOUT_S, LLMGateway
+from response_policy import choose_reply_mode, record_reply, render_template
+from metrics import REQUEST_LATENCY, REQUESTS, log_event, render_metrics, timed
+from autocomplete import SUGGEST_LIMIT, SUGGEST_MAX_LIMIT
+from cart_agent import MAX_ITEM_QUANTITY
+from serialization import (
+    CartChatResponse, OrderChatResponse, ProductChatResponse, SupportChatResponse,
+    UnknownChatResponse, json_response
+)
+from fastapi.middleware.cors import CORSMiddleware
+
+app = FastAPI()
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# === Configurable Fallback Messages ===
+FALLBACK_MESSAGES = {
+    "product": lambda query: (
+        f"Sorry, we couldn’t find any products matching your request: \"{query}\". "
+        "Please try a different search or adjust your filters."
+    ),
+    "order": (
+        "Sorry, we couldn’t find any details for your order. "
+        "Please make sure you’ve entered the correct order number."
+    ),
+    "support": (
+        "Sorry, we couldn’t find any information for your request. "
+        "Please provide more details so we can assist you better."
+    ),
+    "cart": {
+        "message": "🛒 Your cart is empty or the action could not be completed.",
+        "cart": [],
+        "total": 0
+    }
+}
+
+MAX_BATCH_QUERIES = 256
+MAX_BULK_CART_ITEMS = 100
+ADMIN_TOKEN = os.getenv("HAPPYCART_ADMIN_TOKEN", "")  # X-Admin-Token for /catalog/reload; unset disables it
+
+# === Models ===
+class ChatRequest(BaseModel):
+    query: str
+    session_id: Optional[str] = None   # enables follow-ups on the session's last search
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+
+class CartItem(BaseModel):
+    productID: str
+    quantity: int = Field(1, ge=1, le=MAX_ITEM_QUANTITY)
+
+class BulkCartRequest(BaseModel):
+    user_id: str = "guest"
+    action: Literal["add", "remove"] = "add"
+    items: List[CartItem]
+
+# === Helper: Remove unwanted prefixes from LLM output ===
+def clean_response(text: str) -> str:
+    remove_prefixes = (
+        "customer question:",
+        "support response:",
+        "here's a sample response:",
+        "here's a polite and helpful",
+    )
+    lines = text.splitlines()
+    cleaned = [
+        line.strip()
+        for line in lines
+        if not any(line.strip().lower().startswith(p) for p in remove_prefixes)
+    ]
+    return " ".join(cleaned).strip()
+
+# === Call LLaMA 3 safely ===
+def llama_response(prompt: str, intent: str = "") -> Optional[str]:
+    try:
+        with timed("llm", intent):
+            result = subprocess.run(
+                ["ollama", "run", "llama3", prompt],
+                capture_output=True,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+                timeout=LLM_TIMEOUT_S
+            )
+        return clean_response(result.stdout.strip())
+    except subprocess.TimeoutExpired:
+        log_event("llm_timeout", sampled=False, intent=intent, timeout_s=LLM_TIMEOUT_S)
+        return None   # answered from the template, like a shed request
+    except Exception as e:
+        log_event("llm_error", sampled=False, intent=intent, error=str(e))
+        return "Sorry, something went wrong while processing your request."
+
+llm_gateway = LLMGateway(llama_response)
+
+# === Reply Generation (template fast path or LLM, per RESPONSE_POLICY) ===
+def generate_reply(intent: str, query: str, result) -> str:
+    mode = choose_reply_mode(intent, result)
+    if mode == "template":
+        record_reply(intent, "template")
+        return render_template(intent, result)
+
+    text = llm_gateway.generate(build_prompt(intent, query, result), intent)
+    if text is None:   # LLM saturated → degrade to the template reply
+        record_reply(intent, "shed")
+        return render_template(intent, result)
+    record_reply(intent, "llm")
+    return text
+
+# === Chat Endpoint ===
+@app.post("/chat")
+def chat_endpoint(req: ChatRequest, fields: Optional[str] = None,
+                  accept_encoding: Annotated[str, Header()] = ""):
+    """Typed reply per intent. `fields` projects the payload (e.g. "type,message,products.title");
+    large bodies are brotli/gzip-compressed when the client accepts it."""
+    start = time.perf_counter()
+    raw_result = run_agents(req.query, session_id=req.session_id)
+    intent = raw_result.get("intent", "")
+
+    # ================= PRODUCT INTENT =================
+    if intent == "product":
+        products_list = raw_result.get("products", [])
+        if products_list:
+            message = generate_reply(intent, req.query, products_list)
+        else:
+            record_reply(intent, "fallback")
+            message = FALLBACK_MESSAGES["product"](req.query)
+        payload = ProductChatResponse(message=message, search_query=req.query, products=products_list)
+
+    # ================= CART INTENT =================
+    elif intent == "cart":
+        if raw_result.get("cart"):
+            record_reply(intent, "template")
+            message = ""   # silent → no chatbot reply
+        else:
+            record_reply(intent, "fallback")
+            message = FALLBACK_MESSAGES["cart"]["message"]
+        payload = CartChatResponse(
+            message=message, search_query=req.query, cart=raw_result.get("cart", []),
+            total=raw_result.get("total", 0), count=raw_result.get("count", 0)
+        )
+
+    # ================= ORDER INTENT =================
+    elif intent == "order":
+        order = raw_result.get("result")
+        if order:
+            message = generate_reply(intent, req.query, order)
+        else:
+            record_reply(intent, "fallback")
+            message = FALLBACK_MESSAGES["order"]
+        payload = OrderChatResponse(message=message, search_query=req.query, order=order or None)
+
+    # ================= SUPPORT INTENT =================
+    elif intent == "support":
+        entry = raw_result.get("result")
+        if entry:
+            message = generate_reply(intent, req.query, entry)
+        else:
+            record_reply(intent, "fallback")
+            message = FALLBACK_MESSAGES["support"]
+        payload = SupportChatResponse(message=message, search_query=req.query, support=entry or None)
+
+    # ================= UNKNOWN INTENT =================
+    else:
+        payload = UnknownChatResponse(
+            search_query=req.query,
+            message=(
+                "Sorry, I’m not sure how to handle that request. "
+                "Please try rephrasing or provide more details."
+            )
+        )
+
+    with timed("serialization", payload.type):
+        response = json_response(payload, accept_encoding, fields)
+
+    elapsed = time.perf_counter() - start
+    REQUESTS.labels(intent=payload.type).inc()
+    REQUEST_LATENCY.labels(intent=payload.type).observe(elapsed)
+    log_event(
+        "chat_response",
+        intent=payload.type,
+        query=req.query,
+        products=len(getattr(payload, "products", [])),
+        message_chars=len(payload.message),
+        response_bytes=len(response.body),
+        latency_ms=round(elapsed * 1000, 2)
+    )
+    return response
+
+
+# === Prometheus Metrics Endpoint ===
+@app.get("/metrics")
+def metrics_endpoint():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+# === Batch Product Search Endpoint ===
+@app.post("/search/batch")
+def batch_search_endpoint(req: BatchSearchRequest, accept_encoding: Annotated[str, Header()] = ""):
+    if len(req.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch.")
+    if req.top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1.")
+
+    results = search_products_batch(req.queries, top_k=req.top_k)
+    return json_response({
+        "results": [
+            {"search_query": query, "products": products}
+            for query, products in zip(req.queries, results)
+        ]
+    }, accept_encoding)
+
+
+# === Cart Badge Endpoint ===
+@app.get("/cart/summary")
+def cart_summary_endpoint(user_id: str = "guest"):
+    return cart_summary(user_id)
+
+
+# === Bulk Cart Endpoint ===
+@app.post("/cart/bulk")
+def bulk_cart_endpoint(req: BulkCartRequest):
+    if not req.items:
+        raise HTTPException(status_code=400, detail="items must not be empty.")
+    if len(req.items) > MAX_BULK_CART_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_CART_ITEMS} items per request.")
+
+    return bulk_cart(req.user_id, req.action, [(item.productID, item.quantity) for item in req.items])
+
+
+# === Autocomplete Endpoint ===
+@app.get("/autocomplete")
+def autocomplete_endpoint(q: str = "", limit: int = SUGGEST_LIMIT):
+    """Typeahead suggestions for a prefix, from the in-memory index (no routing, embedding or LLM)"""
+    if not 1 <= limit <= SUGGEST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SUGGEST_MAX_LIMIT}.")
+    return json_response({"query": q, "suggestions": suggest(q, limit)})
+
+
+# === Catalog Reload Endpoint ===
+@app.post("/catalog/reload")
+def catalog_reload_endpoint(x_admin_token: Annotated[str, Header()] = ""):
+    """Reload products + vectors after the catalog changed; rebuilds the autocomplete index too"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Catalog reload is disabled (set HAPPYCART_ADMIN_TOKEN).")
+    if not hmac.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+    try:
+        stats = reload_catalog()
+    except CatalogReloadInProgress:
+        raise HTTPException(status_code=409, detail="A catalog reload is already running.")
+    log_event("catalog_reloaded", sampled=False, **stats)
+    return stats
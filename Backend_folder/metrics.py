@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# ===== Config =====
+LOG_SAMPLE_RATE = float(os.getenv("HAPPYCART_LOG_SAMPLE_RATE", "0.05"))  # share of per-request logs kept
+STAGES = ["routing", "filter", "embed", "vector_search", "db", "llm_queue", "llm", "serialization"]
+
+logger = logging.getLogger("happycart")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# ===== Prometheus Metrics =====
+STAGE_LATENCY = Histogram(
+    "happycart_stage_latency_seconds",
+    "Latency of each pipeline stage",
+    ["stage", "intent"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_LATENCY = Histogram(
+    "happycart_request_latency_seconds",
+    "End-to-end latency of /chat requests",
+    ["intent"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+REQUESTS = Counter("happycart_requests_total", "Handled /chat requests", ["intent"])
+REPLIES = Counter("happycart_replies_total", "Chat replies by how they were produced (llm, template, fallback, shed)", ["intent", "mode"])
+LLM_SHED = Counter("happycart_llm_shed_total", "LLM requests rejected by admission control", ["intent", "reason"])
+LLM_COALESCED = Counter("happycart_llm_coalesced_total", "LLM requests served by an identical in-flight generation", ["intent"])
+
+# Extra in-process observers (e.g. the benchmark) receive every (stage, intent, seconds) sample
+_stage_observers = []
+
+
+def add_stage_observer(callback):
+    _stage_observers.append(callback)
+
+
+def remove_stage_observer(callback):
+    if callback in _stage_observers:
+        _stage_observers.remove(callback)
+
+
+def observe_stage(stage, intent, seconds):
+    STAGE_LATENCY.labels(stage=stage, intent=intent or "unknown").observe(seconds)
+    for callback in _stage_observers:
+        callback(stage, intent, seconds)
+
+
+class Span:
+    """Timing span; `intent` may be set inside the block once it is known (e.g. after routing)."""
+
+    def __init__(self, stage, intent=""):
+        self.stage = stage
+        self.intent = intent
+        self.seconds = 0.0
+
+
+@contextmanager
+def timed(stage, intent=""):
+    span = Span(stage, intent)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span.seconds = time.perf_counter() - start
+        observe_stage(span.stage, span.intent, span.seconds)
+
+
+# ===== Structured Logging =====
+def should_sample():
+    return random.random() < LOG_SAMPLE_RATE
+
+
+def log_event(event, sampled=True, **fields):
+    """Emit one JSON log line. Per-request events are sampled at LOG_SAMPLE_RATE; pass sampled=False to always log."""
+    if sampled and not should_sample():
+        return
+    logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str, ensure_ascii=False))
+
+
+def render_metrics():
+    """Body and content type for the /metrics endpoint"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,116 @@
+"""
+Versioned schema migrations for the HappyCart PostgreSQL database.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied / pending versions
+
+embeddings_and_db.setup_tables creates the base tables and then applies these, so a fresh
+database and an existing one end up with the same schema.
+"""
+import argparse
+
+import psycopg2
+
+# ===== DB Config =====
+DB_CONFIG = {
+    "dbname": "happycart",
+    "user": "happyuser",
+    "password": "happypass",
+    "host": "localhost",
+    "port": "5432"
+}
+
+MIGRATION_LOCK_ID = 727001  # pg_advisory_xact_lock key, so concurrent starts migrate once
+
+create_migrations_table = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# ===== Migrations =====
+# (version, name, SQL) — append only; never edit a migration that has shipped.
+MIGRATIONS = [
+    (1, "cart_items_user_product_key", """
+        -- Merge duplicate (user_id, product_id) rows before adding the unique key
+        WITH merged AS (
+            SELECT MIN(id) AS keep_id, user_id, product_id, SUM(quantity) AS quantity
+            FROM cart_items
+            GROUP BY user_id, product_id
+            HAVING COUNT(*) > 1
+        ),
+        updated AS (
+            UPDATE cart_items c SET quantity = m.quantity
+            FROM merged m WHERE c.id = m.keep_id
+        )
+        DELETE FROM cart_items c
+        USING merged m
+        WHERE c.user_id = m.user_id AND c.product_id = m.product_id AND c.id <> m.keep_id;
+
+        DELETE FROM cart_items WHERE quantity IS NULL OR quantity <= 0;
+
+        -- Leading user_id column also serves the per-user cart lookups
+        CREATE UNIQUE INDEX cart_items_user_product_key ON cart_items (user_id, product_id);
+        ALTER TABLE cart_items
+            ALTER COLUMN quantity SET NOT NULL,
+            ADD CONSTRAINT cart_items_quantity_positive CHECK (quantity > 0);
+    """),
+    (2, "cart_summaries", """
+        CREATE TABLE cart_summaries (
+            user_id VARCHAR PRIMARY KEY,
+            item_count INT NOT NULL DEFAULT 0,
+            total_price BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        INSERT INTO cart_summaries (user_id, item_count, total_price)
+        SELECT c.user_id, SUM(c.quantity), SUM(c.quantity * p.price)
+        FROM cart_items c
+        JOIN products p ON c.product_id = p.product_id
+        GROUP BY c.user_id;
+    """),
+]
+
+
+def applied_versions(cur):
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def apply_migrations(conn):
+    """Apply pending migrations in order, each in its own transaction; returns the versions applied"""
+    with conn, conn.cursor() as cur:
+        cur.execute(create_migrations_table)
+
+    applied = []
+    for version, name, sql in MIGRATIONS:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            if version in applied_versions(cur):
+                continue
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply HappyCart schema migrations")
+    parser.add_argument("--status", action="store_true", help="only list applied and pending migrations")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if args.status:
+            with conn, conn.cursor() as cur:
+                cur.execute(create_migrations_table)
+                done = applied_versions(cur)
+            for version, name, _ in MIGRATIONS:
+                print(f"{'✅' if version in done else '⏳'} {version:03d} {name}")
+        else:
+            applied = apply_migrations(conn)
+            print(f"✅ Applied migrations: {applied}" if applied else "✅ Schema is up to date.")
+    finally:
+        conn.close()
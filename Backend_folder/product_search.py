@@ -1,186 +1,392 @@
-import faiss
-import re
-import psycopg2
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import json
-
-# ===== DB Config =====
-DB_CONFIG = {
-    "dbname": "happycart",
-    "user": "happyuser",
-    "password": "happypass",
-    "host": "localhost",
-    "port": "5432"
-}
-
-# ===== Config =====
-FAISS_INDEX_FILE = "embeddings/faiss_index.index"
-ID_MAPPING_FILE = "embeddings/id_mapping.json"
-EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-
-CATEGORY_SYNONYMS = {
-    "shoes": ["shoes", "sneakers", "joggers", "sandals"],
-    "shirts": ["shirts", "t-shirts", "tees", "tshirt"],
-    "jeans": ["jeans", "pants", "trousers"],
-    "sunglasses": ["glasses", "sunglasses", "shades"]
-}
-
-COLOR_KEYWORDS = [
-    "black", "white", "red", "blue", "green", "yellow", "pink", "grey", "gray", "orange", "purple", "brown"
-]
-
-GENDER_KEYWORDS = {
-    "men": ["men", "men's", "male", "boy", "boys", "man"],
-    "women": ["women", "women's", "female", "girl", "girls", "woman"],
-    "unisex": ["unisex"]
-}
-
-
-class ProductSearchAgent:
-    def __init__(self, faiss_index_file, id_mapping_file, embedding_model):
-        # Load FAISS + embedder
-        self.index = faiss.read_index(faiss_index_file)
-        with open(id_mapping_file, "r", encoding="utf-8") as f:
-            self.id_mapping = json.load(f)
-        self.embedder = SentenceTransformer(embedding_model)
-
-        # Load products from PostgreSQL
-        self.products = self.load_products_from_db()
-
-    def load_products_from_db(self):
-        """Fetch all products from PostgreSQL into a dict {product_id: product_data}"""
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute("SELECT product_id, title, description, price, category, image_url FROM products;")
-        rows = cur.fetchall()
-        conn.close()
-
-        products = {}
-        for r in rows:
-            products[r[0]] = {
-                "productID": r[0],
-                "title": r[1],
-                "description": r[2] if r[2] else "",
-                "price": float(r[3]),
-                "category": r[4],
-                "image_url": r[5] if r[5] else "https://via.placeholder.com/200"
-            }
-        return products
-
-    # ===== Detection Helpers =====
-    def detect_category(self, query):
-        query_lower = query.lower()
-        for category, keywords in CATEGORY_SYNONYMS.items():
-            if any(re.search(rf"\b{re.escape(kw)}\b", query_lower) for kw in keywords):
-                return category
-        return None
-
-    def detect_color(self, query):
-        query_lower = query.lower()
-        for color in COLOR_KEYWORDS:
-            if re.search(rf"\b{color}\b", query_lower):
-                return color
-        return None
-
-    def detect_gender_from_query(self, query):
-        query_lower = query.lower()
-        for gender, keywords in GENDER_KEYWORDS.items():
-            if any(re.search(rf"\b{re.escape(kw)}\b", query_lower) for kw in keywords):
-                return gender
-        return None
-
-    def detect_gender_from_product(self, product):
-        text = f"{product.get('title', '')} {product.get('description', '')}".lower()
-        for gender, keywords in GENDER_KEYWORDS.items():
-            if any(re.search(rf"\b{re.escape(kw)}\b", text) for kw in keywords):
-                return gender
-        return None
-
-    def detect_price_filter(self, query):
-        query_lower = query.lower()
-        match = re.search(r"(under|below|less than)\s*(\d+)", query_lower)
-        if match:
-            return ("lte", int(match.group(2)))
-        match = re.search(r"(above|over|more than)\s*(\d+)", query_lower)
-        if match:
-            return ("gte", int(match.group(2)))
-        if any(word in query_lower for word in ["lowest", "cheapest", "least"]):
-            return ("min", None)
-        if any(word in query_lower for word in ["highest", "most expensive", "costliest"]):
-            return ("max", None)
-        return None, None
-
-    # ===== Core Search =====
-    def search(self, query, top_k=5):
-        category = self.detect_category(query)
-        query_gender = self.detect_gender_from_query(query)
-        price_dir, price_val = self.detect_price_filter(query)
-        color = self.detect_color(query)
-
-        print(f"\n🔍 Query: {query}")
-        print(f"📂 Category filter: {category}")
-        print(f"🧍 Gender filter from query: {query_gender}")
-        print(f"🎨 Color filter: {color}")
-        print(f"💰 Price filter: {price_dir} {price_val}")
-
-        # ===== Step 1: DB Filtering =====
-        filtered_products = []
-        for pid, prod in self.products.items():
-            if category and prod["category"].lower() != category:
-                continue
-            prod_gender = self.detect_gender_from_product(prod)
-            if query_gender:
-                if prod_gender and prod_gender.lower() != query_gender and prod_gender.lower() != "unisex":
-                    continue
-            if color and color.lower() not in prod["title"].lower() and color.lower() not in prod.get("description", "").lower():
-                continue
-            if price_dir == "lte" and prod["price"] > price_val:
-                continue
-            if price_dir == "gte" and prod["price"] < price_val:
-                continue
-            filtered_products.append(pid)
-
-        if not filtered_products:
-            print("❌ No related products found.")
-            return []
-
-        print(f"📦 Products after DB filtering: {len(filtered_products)}")
-
-        # ===== Special Case: Lowest/Highest Price =====
-        if price_dir in ["min", "max"]:
-            sorted_products = sorted(
-                filtered_products,
-                key=lambda pid: self.products[pid]["price"],
-                reverse=(price_dir == "max")
-            )
-            top_n = sorted_products[:3]
-            return [self.products[pid] for pid in top_n]
-
-        # ===== Step 2: FAISS Search =====
-        subset_embeddings = []
-        subset_ids = []
-        for pid in filtered_products:
-            try:
-                idx = self.id_mapping.index(pid)
-                subset_ids.append(idx)
-                subset_embeddings.append(self.index.reconstruct(idx))
-            except ValueError:
-                continue
-
-        if not subset_embeddings:
-            print("❌ No embeddings found for filtered products.")
-            return []
-
-        subset_embeddings = np.array(subset_embeddings, dtype="float32")
-        dim = subset_embeddings.shape[1]
-        temp_index = faiss.IndexFlatL2(dim)
-        temp_index.add(subset_embeddings)
-
-        query_emb = self.embedder.encode([query]).astype("float32")
-        scores, indices = temp_index.search(query_emb, min(top_k, len(subset_embeddings)))
-        faiss_results = [self.id_mapping[subset_ids[idx]] for idx in indices[0]]
-
-        # Return complete product objects including productID
-        results = [self.products[pid] for pid in faiss_results]
-        return results
+import faiss
+import itertools
+import os
+import re
+import psycopg2
+import numpy as np
+from embedder import load_embedder
+import json
+from metrics import timed, log_event
+from quantization import QuantizedMatrix, nearest_rows
+
+# ===== DB Config =====
+DB_CONFIG = {
+    "dbname": "happycart",
+    "user": "happyuser",
+    "password": "happypass",
+    "host": "localhost",
+    "port": "5432"
+}
+
+# ===== Config =====
+FAISS_INDEX_FILE = "embeddings/faiss_index.index"
+ID_MAPPING_FILE = "embeddings/id_mapping.json"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+CATEGORY_SYNONYMS = {
+    "shoes": ["shoes", "sneakers", "joggers", "sandals"],
+    "shirts": ["shirts", "t-shirts", "tees", "tshirt"],
+    "jeans": ["jeans", "pants", "trousers"],
+    "sunglasses": ["glasses", "sunglasses", "shades"]
+}
+
+COLOR_KEYWORDS = [
+    "black", "white", "red", "blue", "green", "yellow", "pink", "grey", "gray", "orange", "purple", "brown"
+]
+
+SEARCH_BATCH_SIZE = 64  # queries scored per matrix product in search_many
+PRICE_SORT_TOP_N = 3  # results returned for cheapest / most expensive queries
+CONTEXT_MAX_CANDIDATES = 10000  # larger candidate sets are re-filtered on follow-ups instead of cached
+
+GENDER_KEYWORDS = {
+    "men": ["men", "men's", "male", "boy", "boys", "man"],
+    "women": ["women", "women's", "female", "girl", "girls", "woman"],
+    "unisex": ["unisex"]
+}
+
+
+def load_vectors(faiss_index_file, id_mapping, keep):
+    """(product IDs, QuantizedMatrix of their vectors) for the IDs in `keep`, first index row per ID.
+
+    Reads embeddings.npy (float32 / float16 / int8 codes, see index_meta.json) next to the index
+    if it is there, memory-mapped so only the kept rows are loaded; else reconstructs from FAISS.
+    """
+    first_row = {}
+    for i, pid in enumerate(id_mapping):
+        if pid in keep:
+            first_row.setdefault(pid, i)
+    rows = list(first_row.values())
+
+    embeddings_dir = os.path.dirname(faiss_index_file)
+    embeddings_path = os.path.join(embeddings_dir, "embeddings.npy")
+    meta_path = os.path.join(embeddings_dir, "index_meta.json")
+    meta = None
+    if os.path.exists(embeddings_path) and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        stored = np.load(embeddings_path, mmap_mode="r")
+    if meta and len(stored) == len(id_mapping):
+        vectors = QuantizedMatrix(
+            np.ascontiguousarray(stored[rows]), meta["quantization"],
+            meta.get("int8_offset"), meta.get("int8_scale")
+        )
+    else:
+        index = faiss.read_index(faiss_index_file)
+        vectors = QuantizedMatrix.quantize(index.reconstruct_n(0, index.ntotal)[rows])
+    return list(first_row), vectors
+
+
+class ProductSearchAgent:
+    def __init__(self, faiss_index_file, id_mapping_file, embedding_model, embedder=None):
+        # Load FAISS + embedder (a catalog reload passes the already loaded embedder)
+        self.faiss_index_file = faiss_index_file
+        self.id_mapping_file = id_mapping_file
+        with open(id_mapping_file, "r", encoding="utf-8") as f:
+            self.id_mapping = json.load(f)
+        self.embedder = embedder or load_embedder(embedding_model)
+
+        # Load products from PostgreSQL
+        self.products = self.load_products_from_db()
+        self.price_index = self.build_price_index()
+        self.load_product_embeddings()
+
+    def load_products_from_db(self):
+        """Fetch all products from PostgreSQL into a dict {product_id: product_data}"""
+        with timed("db", "product"):
+            conn = psycopg2.connect(**DB_CONFIG)
+            cur = conn.cursor()
+            cur.execute("SELECT product_id, title, description, price, category, image_url FROM products;")
+            rows = cur.fetchall()
+            conn.close()
+
+        products = {}
+        for r in rows:
+            products[r[0]] = {
+                "productID": r[0],
+                "title": r[1],
+                "description": r[2] if r[2] else "",
+                "price": float(r[3]),
+                "category": r[4],
+                "image_url": r[5] if r[5] else "https://via.placeholder.com/200"
+            }
+        return products
+
+    def load_product_embeddings(self):
+        """Load product vectors once, with a productID → row lookup"""
+        self.embedding_ids, self.product_embeddings = load_vectors(self.faiss_index_file, self.id_mapping, self.products)
+        self.pid_to_row = {pid: row for row, pid in enumerate(self.embedding_ids)}
+        log_event("product_embeddings_loaded", sampled=False, mode=self.product_embeddings.mode,
+                  rows=len(self.product_embeddings), bytes=int(self.product_embeddings.nbytes))
+
+    def build_price_index(self):
+        """Presort product IDs by price, per category and across the whole catalog ("all")"""
+        price_index = {"all": sorted(self.products, key=lambda pid: self.products[pid]["price"])}
+        for pid in price_index["all"]:
+            category = self.products[pid]["category"].lower()
+            price_index.setdefault(category, []).append(pid)
+        return price_index
+
+    # ===== Detection Helpers =====
+    def detect_category(self, query):
+        query_lower = query.lower()
+        for category, keywords in CATEGORY_SYNONYMS.items():
+            if any(re.search(rf"\b{re.escape(kw)}\b", query_lower) for kw in keywords):
+                return category
+        return None
+
+    def detect_color(self, query):
+        query_lower = query.lower()
+        for color in COLOR_KEYWORDS:
+            if re.search(rf"\b{color}\b", query_lower):
+                return color
+        return None
+
+    def detect_gender_from_query(self, query):
+        query_lower = query.lower()
+        for gender, keywords in GENDER_KEYWORDS.items():
+            if any(re.search(rf"\b{re.escape(kw)}\b", query_lower) for kw in keywords):
+                return gender
+        return None
+
+    def detect_gender_from_product(self, product):
+        text = f"{product.get('title', '')} {product.get('description', '')}".lower()
+        for gender, keywords in GENDER_KEYWORDS.items():
+            if any(re.search(rf"\b{re.escape(kw)}\b", text) for kw in keywords):
+                return gender
+        return None
+
+    def detect_price_filter(self, query):
+        query_lower = query.lower()
+        match = re.search(r"(under|below|less than)\s*(\d+)", query_lower)
+        if match:
+            return ("lte", int(match.group(2)))
+        match = re.search(r"(above|over|more than)\s*(\d+)", query_lower)
+        if match:
+            return ("gte", int(match.group(2)))
+        if any(word in query_lower for word in ["lowest", "cheapest", "least"]):
+            return ("min", None)
+        if any(word in query_lower for word in ["highest", "most expensive", "costliest"]):
+            return ("max", None)
+        return None, None
+
+    def parse_filters(self, query):
+        price_dir, price_val = self.detect_price_filter(query)
+        return {
+            "category": self.detect_category(query),
+            "gender": self.detect_gender_from_query(query),
+            "color": self.detect_color(query),
+            "price_dir": price_dir,
+            "price_val": price_val,
+        }
+
+    def matches_filters(self, prod, filters):
+        category, query_gender, color = filters["category"], filters["gender"], filters["color"]
+        price_dir, price_val = filters["price_dir"], filters["price_val"]
+        if category and prod["category"].lower() != category:
+            return False
+        if query_gender:
+            prod_gender = self.detect_gender_from_product(prod)
+            if prod_gender and prod_gender.lower() != query_gender and prod_gender.lower() != "unisex":
+                return False
+        if color and color.lower() not in prod["title"].lower() and color.lower() not in prod.get("description", "").lower():
+            return False
+        if price_dir == "lte" and prod["price"] > price_val:
+            return False
+        if price_dir == "gte" and prod["price"] < price_val:
+            return False
+        if price_dir == "lt" and prod["price"] >= price_val:
+            return False
+        if price_dir == "gt" and prod["price"] <= price_val:
+            return False
+        return True
+
+    def filter_candidates(self, filters):
+        """Step 1: IDs of all products passing the query filters"""
+        return [pid for pid, prod in self.products.items() if self.matches_filters(prod, filters)]
+
+    def price_sorted(self, filters, top_k, offset=0):
+        """Walk the presorted price index and stop once offset + N matches are found,
+        instead of filtering and sorting the whole catalog."""
+        ordered = self.price_index.get(filters["category"] or "all", [])
+        if filters["price_dir"] == "max":
+            ordered = reversed(ordered)
+        matches = (pid for pid in ordered if self.matches_filters(self.products[pid], filters))
+        return list(itertools.islice(matches, offset, offset + min(top_k, PRICE_SORT_TOP_N)))
+
+    def rank_candidates(self, query_embs, candidate_lists, top_k, offset=0, with_distances=False):
+        """Step 2: exact L2 top-k for a batch of query embeddings, each restricted to its own candidates.
+
+        The union of all candidate vectors is scored against every query in one pass over the
+        stored (possibly fp16 / int8) rows, decoded chunk by chunk (see `nearest_rows`); rows
+        outside a query's candidates are masked out.
+        With `with_distances`, each result is a (productID, squared L2 distance) pair.
+        """
+        rows = sorted({self.pid_to_row[pid] for cands in candidate_lists for pid in cands if pid in self.pid_to_row})
+        if not rows:
+            return [[] for _ in candidate_lists]
+        column_of = {row: col for col, row in enumerate(rows)}
+        allowed = np.zeros((len(candidate_lists), len(rows)), dtype=bool)
+        for i, cands in enumerate(candidate_lists):
+            allowed[i, [column_of[self.pid_to_row[pid]] for pid in cands if pid in self.pid_to_row]] = True
+
+        positions, distances = nearest_rows(query_embs, self.product_embeddings, rows, offset + top_k, allowed)
+        ranked = []
+        for cols, dist in zip(positions, distances):
+            top = [(col, d) for col, d in zip(cols[offset:], dist[offset:]) if np.isfinite(d)]
+            if with_distances:
+                ranked.append([(self.embedding_ids[rows[col]], float(d)) for col, d in top])
+            else:
+                ranked.append([self.embedding_ids[rows[col]] for col, _ in top])
+        return ranked
+
+    # ===== Core Search =====
+    def search(self, query, top_k=5, offset=0):
+        return self.search_with_context(query, top_k, offset)[0]
+
+    def search_with_context(self, query, top_k=5, offset=0):
+        """`search`, plus the context a follow-up query needs (see `follow_up`): parsed filters,
+        candidate IDs (as searched, and as narrowed by follow-ups), the query embedding and the
+        IDs that were shown."""
+        context = {"query": query, "base_candidates": None, "candidates": None, "embedding": None,
+                   "price_sort": None, "shown": [], "offset": offset, "top_k": top_k}
+        with timed("filter", "product"):
+            filters = self.parse_filters(query)
+            context["filters"] = filters
+
+            # ===== Special Case: Lowest/Highest Price =====
+            if filters["price_dir"] in ["min", "max"]:
+                top_n = self.price_sorted(filters, top_k, offset)
+            else:
+                # ===== Step 1: DB Filtering =====
+                filtered_products = self.filter_candidates(filters)
+                if len(filtered_products) <= CONTEXT_MAX_CANDIDATES:
+                    context["base_candidates"] = context["candidates"] = filtered_products
+
+        if filters["price_dir"] in ["min", "max"]:
+            log_event("product_search", query=query, filters=filters, mode="price_sorted", results=len(top_n))
+            context["shown"] = top_n
+            context["price_sort"] = filters["price_dir"]
+            return [self.products[pid] for pid in top_n], context
+
+        if not filtered_products:
+            log_event("product_search", query=query, filters=filters, candidates=0, results=0)
+            return [], context
+
+        # ===== Step 2: Vector Search =====
+        with timed("embed", "product"):
+            query_emb = self.embedder.encode([query]).astype("float32")
+        with timed("vector_search", "product"):
+            faiss_results = self.rank_candidates(query_emb, [filtered_products], top_k, offset)[0]
+
+        log_event("product_search", query=query, filters=filters,
+                  candidates=len(filtered_products), results=len(faiss_results))
+        context["embedding"] = query_emb
+        context["shown"] = faiss_results
+        if not faiss_results:
+            return [], context
+
+        # Return complete product objects including productID
+        results = [self.products[pid] for pid in faiss_results]
+        return results, context
+
+    # ===== Follow-up Queries =====
+    def rank_context(self, context, candidates, top_k, offset=0):
+        """Rank `candidates` for a previous search without re-embedding it: by the cached query
+        embedding, or by price for cheapest / most expensive searches"""
+        filters = context["filters"]
+        if context["embedding"] is None:
+            if candidates is None and filters["price_dir"] in ["min", "max"]:
+                return self.price_sorted(filters, top_k, offset)
+            if candidates is None:
+                candidates = self.filter_candidates(filters)
+            ordered = sorted(candidates, key=lambda pid: self.products[pid]["price"],
+                             reverse=context["price_sort"] == "max")
+            return ordered[offset:offset + min(top_k, PRICE_SORT_TOP_N)]
+        if candidates is None:
+            candidates = self.filter_candidates(filters)
+        return self.rank_candidates(context["embedding"], [candidates], top_k, offset)[0]
+
+    def follow_up(self, context, kind, query, top_k=None):
+        """Answer a follow-up from a previous search's context instead of searching again.
+
+        kind: "more" (next page), "cheaper" / "pricier" (than everything shown) or "refine"
+        (extra filters parsed from `query`, e.g. "only black ones"); filters named in a cheaper /
+        pricier query are applied too. Returns (products, context);
+        the old context is kept when nothing matches, so the user can try another follow-up.
+        """
+        top_k = top_k or context["top_k"]
+        candidates = context["candidates"]
+        filters = context["filters"]
+        offset = 0
+
+        with timed("filter", "product"):
+            if kind == "more":
+                offset = context["offset"] + len(context["shown"])
+            else:
+                # Filters the follow-up names itself ("cheaper red ones") apply on top of the cached ones
+                filters = dict(filters)
+                filters.update({k: v for k, v in self.parse_filters(query).items() if v is not None})
+                shown_prices = [self.products[pid]["price"] for pid in context["shown"] if pid in self.products]
+                if kind == "cheaper" and shown_prices:
+                    filters["price_dir"], filters["price_val"] = "lt", min(shown_prices)
+                elif kind == "pricier" and shown_prices:
+                    filters["price_dir"], filters["price_val"] = "gt", max(shown_prices)
+                # Narrow from the original candidates (a new price bound may replace an earlier one),
+                # or from the catalog if the follow-up changes a filter of the original search
+                base = context["base_candidates"]
+                if any(context["filters"][k] not in (None, filters[k]) for k in ("category", "gender", "color")):
+                    base = None
+                if base is None:
+                    candidates = self.filter_candidates(filters)
+                else:
+                    candidates = [pid for pid in base
+                                  if pid in self.products and self.matches_filters(self.products[pid], filters)]
+
+        with timed("vector_search", "product"):
+            ranked = self.rank_context(dict(context, filters=filters), candidates, top_k, offset)
+
+        log_event("product_follow_up", query=query, kind=kind, filters=filters,
+                  candidates=None if candidates is None else len(candidates), results=len(ranked))
+        if not ranked:
+            return [], context
+        if candidates is not None and len(candidates) > CONTEXT_MAX_CANDIDATES:
+            candidates = None
+        new_context = dict(context, filters=filters, candidates=candidates, shown=ranked, offset=offset, top_k=top_k)
+        return [self.products[pid] for pid in ranked], new_context
+
+    # ===== Batch Search =====
+    def search_many(self, queries, top_k=5):
+        """Search several queries at once: one encoder batch, then batched vector scoring.
+
+        Returns one result list per query, in the same order as `queries`.
+        """
+        results = [[] for _ in queries]
+        semantic = []  # (position, query, candidates) for queries that need vector search
+        with timed("filter", "product_batch"):
+            for i, query in enumerate(queries):
+                filters = self.parse_filters(query)
+                if filters["price_dir"] in ["min", "max"]:
+                    results[i] = [self.products[pid] for pid in self.price_sorted(filters, top_k)]
+                    continue
+                candidates = self.filter_candidates(filters)
+                if candidates:
+                    semantic.append((i, query, candidates))
+
+        if not semantic:
+            return results
+
+        with timed("embed", "product_batch"):
+            query_embs = self.embedder.encode([query for _, query, _ in semantic]).astype("float32")
+        with timed("vector_search", "product_batch"):
+            for start in range(0, len(semantic), SEARCH_BATCH_SIZE):
+                chunk = semantic[start:start + SEARCH_BATCH_SIZE]
+                ranked = self.rank_candidates(
+                    query_embs[start:start + SEARCH_BATCH_SIZE],
+                    [candidates for _, _, candidates in chunk],
+                    top_k
+                )
+                for (i, _, _), pids in zip(chunk, ranked):
+                    results[i] = [self.products[pid] for pid in pids]
+
+        log_event("product_batch_search", queries=len(queries), vector_ranked=len(semantic))
+        return results
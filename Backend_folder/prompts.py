@@ -0,0 +1,84 @@
+import math
+from typing import Any, Dict, List, Optional
+
+# ===== Config =====
+# Stable prefix shared by every prompt so the model server can reuse its KV cache;
+# the per-request parts (facts, customer query) always come after it.
+SYSTEM_PREFIX = (
+    "You are HappyCart's shopping assistant. Reply naturally, briefly and directly, "
+    "using only the facts below. Do not use role labels, templates or phrases like "
+    "'here's a response'."
+)
+
+INTENT_INSTRUCTIONS = {
+    "product": "Recommend or describe these products in a clear way for the customer's request.",
+    "order": "Give a simple, clear update about this order.",
+    "support": "Answer the customer's question using this help-center entry.",
+}
+
+TOKEN_BUDGETS = {"product": 400, "order": 250, "support": 300}  # max prompt tokens per intent
+CHARS_PER_TOKEN = 4               # rough average for llama3 on English text
+DESCRIPTION_MAX_CHARS = 120
+QUERY_MAX_CHARS = 300
+MIN_TRUNCATED_CHARS = 40          # below this, a line that does not fit is dropped, not cut
+ORDER_FIELDS = ["order_id", "action", "status", "eta", "message", "error"]
+
+
+# ===== Helpers =====
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate(text: str, max_chars: int) -> str:
+    text = " ".join(str(text).split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut.rstrip(",.;:") + "…"
+
+
+# ===== Fact Projection =====
+def product_facts(products: List[Dict[str, Any]]) -> List[str]:
+    return [
+        f"- {p.get('title', '')} | Rs {float(p.get('price', 0)):.0f} | "
+        f"{truncate(p.get('description', ''), DESCRIPTION_MAX_CHARS)}"
+        for p in products
+    ]
+
+
+def order_facts(order: Dict[str, Any]) -> List[str]:
+    lines = [f"{field}: {order[field]}" for field in ORDER_FIELDS if order.get(field)]
+    for item in order.get("items") or []:
+        lines.append(f"- {item.get('title', item.get('productID', ''))} x{item.get('quantity', 1)}")
+    return lines
+
+
+def support_facts(entry: Dict[str, Any]) -> List[str]:
+    return [f"Q: {entry.get('question', '')}", f"A: {entry.get('answer', '')}"]
+
+
+FACT_BUILDERS = {"product": product_facts, "order": order_facts, "support": support_facts}
+
+
+# ===== Prompt Builder =====
+def build_prompt(intent: str, query: str, result: Any, budget: Optional[int] = None) -> str:
+    """Compact prompt for `intent`: stable prefix, projected facts, then the customer query.
+
+    Facts are added line by line until the intent's token budget is reached; the line
+    that crosses the budget is truncated to fit (if enough room is left) and the rest dropped.
+    """
+    budget = budget or TOKEN_BUDGETS[intent]
+    head = f"{SYSTEM_PREFIX}\n{INTENT_INSTRUCTIONS[intent]}\n\nFacts:\n"
+    tail = f"\n\nCustomer: {truncate(query, QUERY_MAX_CHARS)}"
+
+    remaining_chars = (budget - estimate_tokens(head + tail)) * CHARS_PER_TOKEN
+    facts = []
+    for line in FACT_BUILDERS[intent](result):
+        if len(line) + 1 > remaining_chars:
+            if remaining_chars > MIN_TRUNCATED_CHARS:
+                facts.append(truncate(line, remaining_chars - 1))
+            break
+        facts.append(line)
+        remaining_chars -= len(line) + 1
+
+    return head + "\n".join(facts) + tail
@@ -0,0 +1,156 @@
+import os
+
+import faiss
+import numpy as np
+
+# ===== Config =====
+QUANTIZATION_MODES = ("none", "fp16", "int8")
+STORAGE_DTYPES = {"none": "float32", "fp16": "float16", "int8": "int8"}
+SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+TRAIN_SAMPLE_SIZE = 100_000   # randomly sampled vectors used to train the FAISS scalar quantizer
+RANK_CHUNK_ROWS = int(os.getenv("HAPPYCART_RANK_CHUNK_ROWS", 4096))  # rows decoded at a time when scoring
+
+
+def build_index(dim, mode="none"):
+    """Empty FAISS L2 index storing vectors as float32, float16 or 8-bit scalar-quantized codes"""
+    if mode == "none":
+        return faiss.IndexFlatL2(dim)
+    return faiss.IndexScalarQuantizer(dim, SQ_TYPES[mode], faiss.METRIC_L2)
+
+
+def int8_params(vectors):
+    """Per-dimension (offset, scale) mapping [min, max] onto the 256 int8 codes"""
+    lo = vectors.min(axis=0).astype("float32")
+    hi = vectors.max(axis=0).astype("float32")
+    scale = (hi - lo) / 255
+    scale[scale == 0] = 1.0
+    return lo, scale
+
+
+class QuantizedMatrix:
+    """Row matrix kept as float32, float16 or per-dimension int8 codes; indexing decodes rows to float32."""
+
+    def __init__(self, data, mode="none", offset=None, scale=None):
+        self.data = data
+        self.mode = mode
+        self.offset = None if offset is None else np.asarray(offset, dtype="float32")
+        self.scale = None if scale is None else np.asarray(scale, dtype="float32")
+        self._squared_norms = None
+
+    @classmethod
+    def quantize(cls, vectors, mode="none", offset=None, scale=None):
+        vectors = np.asarray(vectors, dtype="float32")
+        if mode == "none":
+            return cls(np.ascontiguousarray(vectors), mode)
+        if mode == "fp16":
+            return cls(vectors.astype("float16"), mode)
+        if offset is None:
+            offset, scale = int8_params(vectors)
+        return cls(encode_int8(vectors, offset, scale), mode, offset, scale)
+
+    def __getitem__(self, rows):
+        block = self.data[rows]
+        if self.mode == "int8":
+            return (block.astype("float32") + 128) * self.scale + self.offset
+        return block.astype("float32", copy=False)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def squared_norms(self):
+        """Squared L2 norm of every decoded row, computed once, RANK_CHUNK_ROWS rows at a time"""
+        if self._squared_norms is None:
+            norms = np.empty(len(self), dtype="float32")
+            for start in range(0, len(self), RANK_CHUNK_ROWS):
+                block = self[start:start + RANK_CHUNK_ROWS]
+                norms[start:start + len(block)] = (block ** 2).sum(axis=1)
+            self._squared_norms = norms
+        return self._squared_norms
+
+
+def encode_int8(vectors, offset, scale):
+    codes = np.rint((np.asarray(vectors, dtype="float32") - offset) / scale) - 128
+    return np.clip(codes, -128, 127).astype("int8")
+
+
+def squared_l2(queries, vectors, vector_norms=None):
+    """(queries x vectors) squared L2 distances as one matrix product; vectors already decoded to float32"""
+    queries = np.asarray(queries, dtype="float32")
+    if vector_norms is None:
+        vector_norms = (vectors ** 2).sum(axis=1)
+    return (
+        (queries ** 2).sum(axis=1)[:, None]
+        - 2 * queries @ vectors.T
+        + vector_norms[None, :]
+    )
+
+
+def nearest_rows(queries, matrix, rows, k, allowed=None):
+    """Per query, the k positions in `rows` nearest by squared L2 and their distances, nearest first.
+
+    `matrix` is a QuantizedMatrix; only RANK_CHUNK_ROWS of `rows` are decoded to float32 at a
+    time and each chunk is cut down to the running top k, so memory does not grow with the
+    number of rows. `allowed` (queries x len(rows) bool) masks rows per query; masked rows
+    come back with distance inf if fewer than k are allowed.
+    """
+    queries = np.asarray(queries, dtype="float32")
+    rows = np.asarray(rows)
+    k = min(k, len(rows))
+    best_pos = np.empty((len(queries), 0), dtype=np.int64)
+    best_dist = np.empty((len(queries), 0), dtype="float32")
+    if k == 0:
+        return best_pos, best_dist
+    for start in range(0, len(rows), RANK_CHUNK_ROWS):
+        chunk = rows[start:start + RANK_CHUNK_ROWS]
+        dist = squared_l2(queries, matrix[chunk], matrix.squared_norms[chunk])
+        if allowed is not None:
+            dist[~allowed[:, start:start + len(chunk)]] = np.inf
+        pos = np.broadcast_to(np.arange(start, start + len(chunk)), dist.shape)
+        best_dist = np.concatenate([best_dist, dist], axis=1)
+        best_pos = np.concatenate([best_pos, pos], axis=1)
+        if best_dist.shape[1] > k:
+            top = np.argpartition(best_dist, k - 1, axis=1)[:, :k]
+            best_dist = np.take_along_axis(best_dist, top, axis=1)
+            best_pos = np.take_along_axis(best_pos, top, axis=1)
+    order = np.argsort(best_dist, axis=1, kind="stable")
+    return np.take_along_axis(best_pos, order, axis=1), np.take_along_axis(best_dist, order, axis=1)
+
+
+def top_k_rows(distances, k):
+    """Row indices of the k smallest distances per query, nearest first"""
+    k = min(k, distances.shape[1])
+    if k < distances.shape[1]:
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+    order = np.argsort(np.take_along_axis(distances, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def measure_recall(vectors, mode, offset=None, scale=None, k=10, num_queries=200, seed=0):
+    """recall@k of search over `mode`-quantized `vectors` against exact float32 search.
+
+    Vectors are stored with QuantizedMatrix (int8 with the index's own offset / scale, when
+    given) and scored like ProductSearchAgent.rank_candidates, with `nearest_rows`.
+    The queries are held out: sampled rows are removed from the searched set, so no query
+    is its own nearest neighbour.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if mode == "none" or len(vectors) < 2:
+        return 1.0
+    rng = np.random.default_rng(seed)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[rng.choice(len(vectors), size=min(num_queries, len(vectors) // 2), replace=False)] = True
+    queries, corpus = vectors[held_out], vectors[~held_out]
+    k = min(k, len(corpus))
+
+    stored = QuantizedMatrix.quantize(corpus, mode, offset, scale)
+    truth = top_k_rows(squared_l2(queries, corpus), k)
+    found = nearest_rows(queries, stored, np.arange(len(stored)), k)[0]
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / (len(queries) * k)
@@ -0,0 +1,78 @@
+import os
+from typing import Any, Dict
+
+from metrics import REPLIES
+
+# ===== Config =====
+# Per-intent reply mode, overridable with HAPPYCART_REPLY_<INTENT>:
+#   "llm"      → always generate with the LLM
+#   "template" → always use the deterministic template
+#   "auto"     → template for structured / high-confidence results, LLM otherwise
+REPLY_MODES = ("llm", "template", "auto")
+DEFAULT_POLICY = {"product": "llm", "order": "template", "support": "auto"}
+RESPONSE_POLICY = {
+    intent: os.getenv(f"HAPPYCART_REPLY_{intent.upper()}", mode)
+    for intent, mode in DEFAULT_POLICY.items()
+}
+FAQ_TEMPLATE_MAX_DISTANCE = 0.5  # semantic FAQ hits within this L2 distance use the template in "auto"
+
+for _intent, _mode in RESPONSE_POLICY.items():
+    if _mode not in REPLY_MODES:
+        raise ValueError(f"Reply mode for '{_intent}' must be one of {REPLY_MODES}, got '{_mode}'")
+
+
+# ===== Confidence =====
+def is_confident(intent: str, result: Any) -> bool:
+    """Whether `result` already holds the complete answer"""
+    if intent == "order":
+        return isinstance(result, dict) and result.get("action") != "unknown"
+    if intent == "support":
+        # Exact question matches are answered verbatim; near-exact token matches go to the LLM,
+        # which sees the entry but can still notice that it does not fit the question
+        if not isinstance(result, dict):
+            return False
+        if result.get("match") == "exact":
+            return True
+        return result.get("match") == "semantic" and result.get("score", float("inf")) <= FAQ_TEMPLATE_MAX_DISTANCE
+    return False
+
+
+def choose_reply_mode(intent: str, result: Any) -> str:
+    mode = RESPONSE_POLICY.get(intent, "llm")
+    if mode == "auto":
+        return "template" if is_confident(intent, result) else "llm"
+    return mode
+
+
+def record_reply(intent: str, mode: str):
+    REPLIES.labels(intent=intent, mode=mode).inc()
+
+
+# ===== Templates =====
+def order_template(order: Dict[str, Any]) -> str:
+    if order.get("error"):
+        return order["error"]
+    if order.get("action") == "track":
+        items = ", ".join(
+            f"{item.get('title', item.get('productID', ''))} x{item.get('quantity', 1)}"
+            for item in order.get("items") or []
+        )
+        reply = f"📦 Order {order['order_id']} is {order['status']}. Expected delivery: {order['eta']}."
+        return f"{reply} Items: {items}." if items else reply
+    return order.get("message", "")
+
+
+def support_template(entry: Dict[str, Any]) -> str:
+    return entry.get("answer", "")
+
+
+def product_template(products) -> str:
+    listed = ", ".join(f"{p.get('title', '')} (Rs {float(p.get('price', 0)):.0f})" for p in products)
+    return f"Here are some products you might like: {listed}."
+
+
+TEMPLATES = {"order": order_template, "support": support_template, "product": product_template}
+
+
+def render_template(intent: str, result: Any) -> str:
+    return TEMPLATES[intent](result)
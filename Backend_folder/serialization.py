@@ -0,0 +1,184 @@
+import gzip
+from typing import Any, Dict, List, Literal, Optional, Set, Union
+
+import orjson
+from fastapi.responses import Response
+from pydantic import BaseModel, ConfigDict
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+
+# ===== Config =====
+COMPRESS_MIN_BYTES = 1024   # smaller bodies are sent uncompressed
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4          # fast setting; ratio close to gzip -9 on JSON
+
+Number = Union[int, float]  # keep DB integers as integers on the wire
+
+
+# ===== Response Models =====
+class Product(BaseModel):
+    productID: Optional[str] = None
+    title: Optional[str] = ""
+    description: Optional[str] = ""
+    price: Number = 0
+    image_url: Optional[str] = ""
+
+
+class CartLine(Product):
+    quantity: int
+    item_total: Number
+
+
+class OrderItem(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    productID: Optional[str] = None
+    title: Optional[str] = None
+    quantity: int = 1
+
+
+class OrderResult(BaseModel):
+    action: str
+    order_id: Optional[str] = None
+    status: Optional[str] = None
+    eta: Optional[str] = None
+    items: Optional[List[OrderItem]] = None
+    message: Optional[str] = None
+    error: Optional[str] = None
+
+
+class FaqMatch(BaseModel):
+    question: str
+    answer: str
+    score: float
+    match: str = "semantic"
+
+
+class ChatResponse(BaseModel):
+    """/chat payload: every response carries all of these keys, defaulted when unused by its type"""
+    type: str
+    products: List[Product] = []
+    message: str = ""
+    order: Optional[OrderResult] = None
+    support: Optional[FaqMatch] = None
+    cart: List[CartLine] = []
+    search_query: str = ""
+    total: Number = 0
+
+
+class ProductChatResponse(ChatResponse):
+    type: Literal["product"] = "product"
+
+
+class CartChatResponse(ChatResponse):
+    type: Literal["cart"] = "cart"
+    count: int = 0
+
+
+class OrderChatResponse(ChatResponse):
+    type: Literal["order"] = "order"
+
+
+class SupportChatResponse(ChatResponse):
+    type: Literal["support"] = "support"
+
+
+class UnknownChatResponse(ChatResponse):
+    type: Literal["unknown"] = "unknown"
+
+
+# ===== Field Projection =====
+def parse_fields(fields: Optional[str]) -> Optional[Dict[str, Union[bool, List[str]]]]:
+    """"type,message,products.title,products.price" → {"type": True, "message": True, "products": ["title", "price"]}"""
+    if not fields:
+        return None
+    include = {}
+    for field in fields.split(","):
+        name, _, sub = field.strip().partition(".")
+        if not name:
+            continue
+        if not sub:
+            include[name] = True
+        elif include.get(name) is not True and sub not in include.setdefault(name, []):
+            include[name].append(sub)
+    return include
+
+
+def project(data: Dict[str, Any], include) -> Dict[str, Any]:
+    """Keep only the requested fields; sub-fields apply to each item of a list, or to a nested object"""
+    projected = {}
+    for name, sub in include.items():
+        if name not in data:
+            continue
+        value = data[name]
+        if sub is True:
+            projected[name] = value
+        elif isinstance(value, list):
+            projected[name] = [{k: item[k] for k in sub if k in item} for item in value]
+        elif isinstance(value, dict):
+            projected[name] = {k: value[k] for k in sub if k in value}
+        else:
+            projected[name] = value
+    return projected
+
+
+# ===== Responses =====
+class OrjsonResponse(Response):
+    """JSON response encoded with orjson (fastapi's ORJSONResponse is deprecated)"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    encodings = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        try:
+            weight = float(params.strip().removeprefix("q=") or 1)
+        except ValueError:
+            weight = 1.0
+        if name and weight > 0:
+            encodings.add(name.strip())
+    return encodings
+
+
+def compress(response: Response, accept_encoding: str = "") -> Response:
+    """Brotli (if installed) or gzip for bodies of at least COMPRESS_MIN_BYTES, as the client allows"""
+    if len(response.body) < COMPRESS_MIN_BYTES:
+        return response
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        body, encoding = brotli.compress(response.body, quality=BROTLI_QUALITY), "br"
+    elif "gzip" in accepted:
+        body, encoding = gzip.compress(response.body, compresslevel=GZIP_LEVEL), "gzip"
+    else:
+        return response
+
+    response.body = body
+    response.headers["content-encoding"] = encoding
+    response.headers["content-length"] = str(len(body))
+    response.headers["vary"] = "Accept-Encoding"
+    return response
+
+
+def json_response(content: Union[BaseModel, Dict[str, Any]], accept_encoding: str = "",
+                  fields: Optional[str] = None) -> OrjsonResponse:
+    """orjson-encoded (optionally projected and compressed) response.
+
+    A model's own fields are always present (None as null); unset optional fields of nested
+    objects are omitted. `fields` is the opt-in way to a smaller payload.
+    """
+    if isinstance(content, BaseModel):
+        dumped = content.model_dump(exclude_none=True)
+        data = {name: dumped.get(name) for name in type(content).model_fields}
+    else:
+        data = content
+    include = parse_fields(fields)
+    if include:
+        data = project(data, include)
+    return compress(OrjsonResponse(content=data), accept_encoding)
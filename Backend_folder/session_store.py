@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# ===== Config =====
+SESSION_TTL_S = float(os.getenv("HAPPYCART_SESSION_TTL_S", "1800"))  # idle time before a context is dropped
+SESSION_MAX = int(os.getenv("HAPPYCART_SESSION_MAX", "10000"))       # least recently used sessions evicted beyond this
+
+
+class SessionStore(ABC):
+    """Per-session conversation context (last product search), keyed by the client's session_id.
+
+    Backends implement get / put / delete; `InMemorySessionStore` is the default. A shared
+    backend (e.g. Redis) is needed once several server processes serve the same sessions.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put(self, session_id: str, context: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store with an idle TTL and LRU eviction; contexts are kept as-is (no copies)."""
+
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_sessions: int = SESSION_MAX):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id → (expires_at, context), oldest first
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (now + self.ttl_s, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def put(self, session_id, context):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (now + self.ttl_s, context)
+            self._sessions.move_to_end(session_id)
+            # Oldest entries first: drop expired ones, then enforce the size cap
+            while self._sessions:
+                oldest_id, (expires_at, _) = next(iter(self._sessions.items()))
+                if expires_at > now and len(self._sessions) <= self.max_sessions:
+                    break
+                del self._sessions[oldest_id]
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,149 @@
+"""
+Sharded product search: product vectors are partitioned across worker processes, one shard each.
+
+The coordinator (ShardedProductSearch) keeps product metadata, parses filters and embeds the
+query once; only vector scoring is distributed. `rank_candidates` sends each query's candidates
+to the shards that own them and merges the per-shard top-k. With category sharding, a
+category-filtered query touches a single shard. An unfiltered query fans out to every shard
+in parallel.
+
+    HAPPYCART_SEARCH_SHARDS=4 HAPPYCART_SHARD_BY=hash uvicorn main:app
+"""
+import atexit
+import heapq
+import json
+import multiprocessing
+import os
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import log_event
+from product_search import ProductSearchAgent, load_vectors
+
+# ===== Config =====
+SEARCH_SHARDS = int(os.getenv("HAPPYCART_SEARCH_SHARDS", "0"))  # 0 or 1: single-process ProductSearchAgent
+SHARD_BY = os.getenv("HAPPYCART_SHARD_BY", "category")          # "category" or "hash"
+SHARD_PARTITIONS = ("category", "hash")
+SHARD_WORKERS = int(os.getenv("HAPPYCART_SHARD_WORKERS", "1"))  # processes (replicas) per shard
+
+
+# ===== Worker Process =====
+class ProductShard:
+    """One shard's vectors inside a worker process; scoring is ProductSearchAgent's own"""
+    rank_candidates = ProductSearchAgent.rank_candidates
+
+    def __init__(self, faiss_index_file, id_mapping_file, pids):
+        with open(id_mapping_file, "r", encoding="utf-8") as f:
+            id_mapping = json.load(f)
+        self.embedding_ids, self.product_embeddings = load_vectors(faiss_index_file, id_mapping, set(pids))
+        self.pid_to_row = {pid: row for row, pid in enumerate(self.embedding_ids)}
+
+
+_shard = None
+
+
+def init_shard(faiss_index_file, id_mapping_file, pids):
+    global _shard
+    _shard = ProductShard(faiss_index_file, id_mapping_file, pids)
+
+
+def shard_info():
+    return {"rows": len(_shard.embedding_ids), "bytes": int(_shard.product_embeddings.nbytes)}
+
+
+def shard_rank(query_embs, candidate_lists, k):
+    """Top-k (productID, distance) per query within this shard; None candidates = the whole shard"""
+    candidate_lists = [_shard.embedding_ids if cands is None else cands for cands in candidate_lists]
+    return _shard.rank_candidates(query_embs, candidate_lists, k, with_distances=True)
+
+
+# ===== Coordinator =====
+class ShardedProductSearch(ProductSearchAgent):
+    """ProductSearchAgent whose vector scoring is scattered to shard worker processes"""
+
+    def __init__(self, faiss_index_file, id_mapping_file, embedding_model, embedder=None,
+                 shards=SEARCH_SHARDS, shard_by=SHARD_BY, workers_per_shard=SHARD_WORKERS):
+        if shard_by not in SHARD_PARTITIONS:
+            raise ValueError(f"Unknown shard partition '{shard_by}' (use one of {', '.join(SHARD_PARTITIONS)})")
+        self.shard_count = max(1, shards)
+        self.shard_by = shard_by
+        self.workers_per_shard = max(1, workers_per_shard)
+        self.shards = []
+        super().__init__(faiss_index_file, id_mapping_file, embedding_model, embedder)
+        atexit.register(self.close)
+
+    def assign_shards(self):
+        """productID → shard. By category, whole categories go (largest first) to the least loaded
+        shard; by hash, a stable CRC32 of the productID spreads products evenly."""
+        if self.shard_by == "hash":
+            return {pid: zlib.crc32(pid.encode("utf-8")) % self.shard_count for pid in self.products}
+
+        sizes = Counter(prod["category"].lower() for prod in self.products.values())
+        load = [0] * self.shard_count
+        category_shard = {}
+        for category, size in sizes.most_common():
+            shard = load.index(min(load))
+            category_shard[category] = shard
+            load[shard] += size
+        return {pid: category_shard[prod["category"].lower()] for pid, prod in self.products.items()}
+
+    def load_product_embeddings(self):
+        """Start one worker pool per shard, each loading only its own products' vectors"""
+        self.shard_of = self.assign_shards()
+        shard_pids = [[] for _ in range(self.shard_count)]
+        for pid, shard in self.shard_of.items():
+            shard_pids[shard].append(pid)
+        self.shard_sizes = [len(pids) for pids in shard_pids]
+
+        # spawn, not fork: the coordinator already holds the embedder and its threads
+        context = multiprocessing.get_context("spawn")
+        index_file, mapping_file = os.path.abspath(self.faiss_index_file), os.path.abspath(self.id_mapping_file)
+        self.shards = [
+            ProcessPoolExecutor(max_workers=self.workers_per_shard, mp_context=context,
+                                initializer=init_shard, initargs=(index_file, mapping_file, pids))
+            for pids in shard_pids
+        ]
+        infos = [future.result() for future in [pool.submit(shard_info) for pool in self.shards]]
+        log_event("product_shards_loaded", sampled=False, shard_by=self.shard_by, shards=self.shard_count,
+                  workers_per_shard=self.workers_per_shard, rows=[info["rows"] for info in infos],
+                  bytes=sum(info["bytes"] for info in infos))
+
+    def rank_candidates(self, query_embs, candidate_lists, top_k, offset=0, with_distances=False):
+        """Scatter each query's candidates to the shards that own them, then merge the per-shard top-k.
+
+        Shards without candidates are skipped. A shard whose products are all candidates gets
+        None instead of the ID list, so unfiltered queries don't ship the catalog to every worker.
+        """
+        k = offset + top_k
+        per_shard = [[[] for _ in candidate_lists] for _ in self.shards]
+        for i, cands in enumerate(candidate_lists):
+            for pid in cands:
+                shard = self.shard_of.get(pid)
+                if shard is not None:
+                    per_shard[shard][i].append(pid)
+
+        futures = []
+        for shard, lists in enumerate(per_shard):
+            if not any(lists):
+                continue
+            lists = [None if len(cands) == self.shard_sizes[shard] else cands for cands in lists]
+            futures.append(self.shards[shard].submit(shard_rank, query_embs, lists, k))
+
+        merged = [[] for _ in candidate_lists]
+        for future in futures:
+            for i, hits in enumerate(future.result()):
+                merged[i].extend(hits)
+
+        ranked = []
+        for hits in merged:
+            top = heapq.nsmallest(k, hits, key=lambda hit: hit[1])[offset:]
+            ranked.append(top if with_distances else [pid for pid, _ in top])
+        return ranked
+
+    def close(self, cancel_pending=True):
+        """Shut the shard pools down; also drops the exit hook, so a retired agent can be freed"""
+        atexit.unregister(self.close)
+        for pool in self.shards:
+            pool.shutdown(wait=False, cancel_futures=cancel_pending)
+        self.shards = []
@@ -0,0 +1,73 @@
+"""Parallel mutations of one cart against a real Postgres (skipped when none is reachable)."""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import cart_agent
+
+THREADS = 16
+OPS_PER_THREAD = 30
+SCHEMA = "test_cart_concurrency"
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    try:
+        psycopg2.connect(connect_timeout=3, **cart_agent.DB_CONFIG).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Postgres not available: {e}")
+
+    import benchmark
+    from data import generate_synthetic_catalog
+
+    products = generate_synthetic_catalog(50, seed=0)
+    benchmark.setup_database(SCHEMA, products)
+    yield [p["product_id"] for p in products[:4]]
+    benchmark.drop_database(SCHEMA)
+
+
+def test_parallel_mutations_keep_quantities_and_summary(catalog):
+    pids = catalog
+    seed = THREADS * OPS_PER_THREAD   # enough units that removals never empty a row
+    agent = cart_agent.CartAgent(user_id="test_shared", max_quantity=seed + 2 * THREADS * OPS_PER_THREAD)
+    agent.clear_cart()
+    agent.add_items([(pid, seed) for pid in pids])
+
+    def mutate(t):
+        delta, snapshots = Counter(), []
+        for i in range(OPS_PER_THREAD):
+            pid = pids[(t + i) % len(pids)]
+            op = (t + i) % 3
+            if op == 0:
+                assert agent.add_to_cart(pid, 1)["message"].startswith("✅")
+                delta[pid] += 1
+            elif op == 1:
+                result = agent.add_items([(pid, 2)])
+                snapshots.append(result)
+                delta[pid] += 2
+            else:
+                assert agent.remove_one(pid)["message"].startswith("➖")
+                delta[pid] -= 1
+        return delta, snapshots
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        results = list(pool.map(mutate, range(THREADS)))
+
+    expected = Counter({pid: seed for pid in pids})
+    for delta, snapshots in results:
+        expected.update(delta)
+        # add_items reads the cart in its own transaction: its summary must match its rows
+        for snapshot in snapshots:
+            assert snapshot["count"] == sum(item["quantity"] for item in snapshot["cart"])
+            assert snapshot["total"] == sum(item["item_total"] for item in snapshot["cart"])
+
+    items, total, count = agent._fetch_cart()
+    assert {item["productID"]: item["quantity"] for item in items} == dict(expected)
+    assert count == sum(expected.values())
+    assert total == sum(item["item_total"] for item in items)
+    assert agent.summary() == {"count": count, "total": total}
+    agent.clear_cart()
+    assert agent.summary() == {"count": 0, "total": 0}